@@ -0,0 +1,285 @@
+#!/usr/bin/python3 -Es
+# -*- coding: utf-8 -*-
+##################################################################################
+# Access information about binary and source packages in multiple
+# (independent) apt-repositories utilizing libapt / python-apt/
+# apt_pkg without the need to change the local system and it's apt-setup.
+#
+# Copyright (C) 2017  Christoph Lutz
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+import os
+import re
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledConfig:
+    '''
+        A CompiledConfig is the merged and override-resolved content of all *.suites- and
+        *.repos-files found in a list of base directories. It provides an index that maps
+        repository names (the part of a suite-id before ":"), tags and suite names to the
+        corresponding entries, so suite selectors can be resolved by dictionary lookups.
+
+        A CompiledConfig is bound to a signature of the config files it was built from (their
+        names, mtimes and sizes). It is persisted in a json file, so the config files are only
+        parsed again if one of them was changed, added or removed.
+    '''
+
+    FORMAT = 1
+
+    def __init__(self, signature, suites, repos, warnings):
+        '''
+            Creates a new CompiledConfig:
+
+            signature: The signature of the config files (see getSignature(...)).
+
+            suites: list of (suiteDesc, basedir, filename) tuples in the defined order.
+
+            repos: list of (repoDesc, basedir, filename) tuples in the defined order.
+
+            warnings: list of warning messages that occurred while reading the config files.
+        '''
+        self.signature = signature
+        self.suites = suites
+        self.repos = repos
+        self.warnings = warnings
+        self.suitesIndex = CompiledConfig.__buildIndex(
+            [CompiledConfig.__getSuiteKeys(desc) for (desc, unused_basedir, unused_filename) in suites])
+        self.reposIndex = CompiledConfig.__buildIndex(
+            [CompiledConfig.__getRepoKeys(desc) for (desc, unused_basedir, unused_filename) in repos])
+
+
+    @staticmethod
+    def getSignature(baseDirs):
+        '''
+            Returns a json compatible signature of all *.suites- and *.repos-files in the
+            list of directories baseDirs consisting of their names, mtimes and sizes.
+        '''
+        signature = list()
+        for basedir in baseDirs:
+            if not os.path.isdir(basedir):
+                continue
+            for f in sorted(os.listdir(basedir)):
+                if not (f.endswith(".suites") or f.endswith(".repos")):
+                    continue
+                try:
+                    st = os.stat(basedir + "/" + f)
+                    signature.append([basedir, f, st.st_mtime_ns, st.st_size])
+                except OSError:
+                    continue
+        return [baseDirs, signature]
+
+
+    @staticmethod
+    def build(baseDirs, signature):
+        '''
+            This factory-method creates a new CompiledConfig by reading the *.suites- and
+            *.repos-files in the list of directories baseDirs. Once a file with a particular
+            filename is read, files with the same filename in later directories are ignored.
+        '''
+        suitesData = dict() # map of filename --> (jsonData, basedir)
+        reposData = dict() # map of filename --> (jsonData, basedir)
+        warnings = list()
+        configSectionsCount = 0
+        for basedir in baseDirs:
+            if not os.path.isdir(basedir):
+                if len(suitesData) == 0:
+                    logger.debug("Skipping BaseDir {} which doesn't exist".format(basedir))
+                continue
+            for f in sorted(os.listdir(basedir)):
+                if f in suitesData or f in reposData:
+                    continue
+                filename = basedir + "/" + f
+                if os.path.isfile(filename):
+                    try:
+                        if str(filename).endswith(".suites"):
+                            logger.debug("reading suites file " + filename)
+                            with open(filename, 'r', encoding="utf-8") as file:
+                                jsonData = json.load(file)
+                                suitesData[f] = (jsonData, basedir)
+                                configSectionsCount += len(jsonData)
+                        elif str(filename).endswith(".repos"):
+                            with open(filename, 'r', encoding="utf-8") as file:
+                                jsonData = json.load(file)
+                                reposData[f] = (jsonData, basedir)
+                                configSectionsCount += len(jsonData)
+                    except json.decoder.JSONDecodeError as ex:
+                        warnings.append("Skipping unreadable json file {}: {}".format(filename, ex))
+
+        if configSectionsCount == 0:
+            warnings.append("No *.suites- or *.repos-files found in the directories '" + "', '".join(baseDirs) + "'")
+
+        return CompiledConfig(signature, CompiledConfig.__prepareConfig(suitesData),
+                              CompiledConfig.__prepareConfig(reposData), warnings)
+
+
+    @staticmethod
+    def load(filename, signature):
+        '''
+            This factory-method reads a CompiledConfig from the json file filename.
+            It returns None if the file doesn't exist, is unreadable or if the stored
+            config was compiled for another signature.
+        '''
+        try:
+            with open(filename, 'r') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.debug("Ignoring unreadable config cache {}: {}".format(filename, e))
+            return None
+        if data.get('Format') != CompiledConfig.FORMAT or data.get('Signature') != signature:
+            logger.debug("config cache {} is outdated".format(filename))
+            return None
+        return CompiledConfig(signature, [tuple(e) for e in data['Suites']],
+                              [tuple(e) for e in data['Repos']], data['Warnings'])
+
+
+    def save(self, filename):
+        '''
+            Writes this CompiledConfig to the json file filename. The file is replaced
+            atomically, so concurrent readers either see the old or the new config.
+        '''
+        data = {
+            'Format': CompiledConfig.FORMAT,
+            'Signature': self.signature,
+            'Suites': self.suites,
+            'Repos': self.repos,
+            'Warnings': self.warnings
+        }
+        tmpFile = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(tmpFile, 'w') as fh:
+                json.dump(data, fh, separators=(',', ':'))
+            os.replace(tmpFile, filename)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Could not write config cache {}: {}".format(filename, e))
+
+
+    def selectSuites(self, selRepo, selSuite):
+        '''
+            Returns the sorted list of positions (in self.suites) of the suite entries that could
+            be selected by a selector "<selRepo>:<selSuite>". Entries without a valid suite-id
+            are always returned, so that the caller can report them.
+        '''
+        return self.__select(self.suitesIndex, selRepo, selSuite)
+
+
+    def selectRepos(self, selRepo):
+        '''
+            Returns the sorted list of positions (in self.repos) of the repository entries that
+            could provide suites for a selector "<selRepo>:<someSuite>". Entries without a valid
+            Prefix are always returned, so that the caller can report them.
+        '''
+        return self.__select(self.reposIndex, selRepo, '')
+
+
+    @staticmethod
+    def __select(index, selRepo, selSuite):
+        (all, byRepo, byName, invalid) = index
+        if selRepo == '':
+            candidates = byName.get(selSuite, []) if selSuite != '' else all
+        else:
+            candidates = set(byRepo.get(selRepo, []))
+            if selSuite != '':
+                candidates.intersection_update(byName.get(selSuite, []))
+        return sorted(set(candidates).union(invalid))
+
+
+    @staticmethod
+    def __buildIndex(keys):
+        '''
+            Returns the tuple (all, byRepo, byName, invalid) for the list keys containing a
+            tuple (repoNames, suiteName) for each entry or None if the entry is invalid.
+            repoNames are the repository name and the tags of the entry.
+        '''
+        all = list()
+        byRepo = dict()
+        byName = dict()
+        invalid = list()
+        for position, key in enumerate(keys):
+            if key == None:
+                invalid.append(position)
+                continue
+            all.append(position)
+            (repoNames, suiteName) = key
+            for repo in repoNames:
+                byRepo.setdefault(repo, list()).append(position)
+            if suiteName != None:
+                byName.setdefault(suiteName, list()).append(position)
+        return (all, byRepo, byName, invalid)
+
+
+    @staticmethod
+    def __getSuiteKeys(suiteDesc):
+        try:
+            parts = suiteDesc["Suite"].split(":", 1)
+            (repo, suiteName) = ("", parts[0]) if len(parts) == 1 else parts
+            return (set([repo] + list(suiteDesc.get("Tags", []))), suiteName)
+        except (KeyError, AttributeError, TypeError):
+            return None
+
+
+    @staticmethod
+    def __getRepoKeys(repoDesc):
+        try:
+            repoNames = set([repoDesc['Prefix'].split(":", 1)[0]] + list(repoDesc.get('Tags', list())))
+            for suite in repoDesc.get("Suites", list()):
+                if isinstance(suite, dict):
+                    repoNames.update(suite.get('Tags', list()))
+            # suites of repositories are selected by their prefix and the suite name of the
+            # Release files, so the suite name can't be indexed
+            return (repoNames, None)
+        except (KeyError, AttributeError, TypeError):
+            return None
+
+
+    @staticmethod
+    def __filenameWithoutPrefix(item):
+        (filename, value) = item
+        return re.sub(r"\.\w+$", "", filename)
+
+
+    @staticmethod
+    def __prepareConfig(collectedConfigs):
+        '''
+            Handles overrides and returns a list of config items in the defined order.
+            `collectedConfigs` is expexted to be a map filename -> (jsonData, basedir)
+        '''
+        res = list()
+        mapOidToConf = dict()
+        for filename, (descs, basedir) in sorted(collectedConfigs.items(), key=CompiledConfig.__filenameWithoutPrefix):
+            logger.debug("preparing config from file {}/{}".format(basedir, filename))
+            for conf in descs:
+                if not type(conf) is dict:
+                    continue
+                oid = conf.get("Oid", None)
+                if oid:
+                    toOverride = mapOidToConf.get(oid)
+                    if not toOverride:
+                        mapOidToConf[oid] = conf
+                        logger.debug("new override '{}'".format(oid))
+                    else:
+                        for k, v in conf.items():
+                            toOverride[k] = v
+                            logger.debug("added to override '{}': {} --> {}".format(oid, k, v))
+                        continue
+                res.append((conf, basedir, filename))
+        return res
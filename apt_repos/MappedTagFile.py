@@ -0,0 +1,134 @@
+#!/usr/bin/python3 -Es
+# -*- coding: utf-8 -*-
+##################################################################################
+# Access information about binary and source packages in multiple
+# (independent) apt-repositories utilizing libapt / python-apt/
+# apt_pkg without the need to change the local system and it's apt-setup.
+#
+# Copyright (C) 2017  Christoph Lutz
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+import mmap
+import logging
+import apt_pkg
+
+logger = logging.getLogger(__name__)
+
+
+class MappedTagFile:
+    '''
+        A MappedTagFile provides read access to the sections (stanzas) of a debian
+        control file (e.g. a *_Sources file in var/lib/apt/lists) by mapping the file
+        into memory. In contrast to apt_pkg.TagFile, no data are copied until a field
+        of a section is requested and the pages of the file are shared (via the page
+        cache) between all processes reading the same lists.
+
+        The mapping stays valid as long as a MappedTagFile or one of its StanzaViews
+        is referenced - even if apt replaces the file in the meantime.
+    '''
+
+    def __init__(self, filename):
+        '''
+            Maps the file filename into memory.
+        '''
+        self.filename = filename
+        with open(filename, 'rb') as fh:
+            try:
+                self.data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files can't be mapped
+                self.data = b''
+        self.parsedStart = None
+        self.parsedSection = None
+
+
+    def getSection(self, offset):
+        '''
+            Returns a StanzaView for the section starting at offset, where offset is a
+            value retrieved from apt_pkg.TagFile.offset() before reading the section.
+        '''
+        data = self.data
+        size = len(data)
+        while offset < size and data[offset:offset+1] == b'\n':
+            offset += 1
+        end = data.find(b'\n\n', offset)
+        end = size if end < 0 else end + 1
+        return StanzaView(self, offset, end)
+
+
+    def parseSection(self, start, end):
+        '''
+            Returns the apt_pkg.TagSection for the data between start and end. Only the
+            most recently parsed section is kept, so reading the fields of sections one
+            after another holds at most one parsed copy per MappedTagFile.
+        '''
+        if self.parsedStart != start:
+            self.parsedSection = apt_pkg.TagSection(self.data[start:end])
+            self.parsedStart = start
+        return self.parsedSection
+
+
+class StanzaView:
+    '''
+        A StanzaView is a lightweight, read-only view (offset and end) of a single section
+        in a MappedTagFile. It supports the parts of the apt_pkg.TagSection interface used
+        by apt-repos (section[key], section.get(key), key in section, keys() and str(section)).
+        The section is only parsed (by apt_pkg) if one of its fields is requested, so e.g.
+        the full record of a section is passed on without being parsed or copied.
+    '''
+
+    __slots__ = ('tagFile', 'start', 'end')
+
+    def __init__(self, tagFile, start, end):
+        self.tagFile = tagFile
+        self.start = start
+        self.end = end
+
+
+    def __getitem__(self, key):
+        return self.tagFile.parseSection(self.start, self.end)[key]
+
+
+    def __contains__(self, key):
+        return key in self.tagFile.parseSection(self.start, self.end)
+
+
+    def get(self, key, default=None):
+        '''
+            Returns the value of the field key or default if the section doesn't contain
+            the field. Like in apt_pkg, field names are case insensitive.
+        '''
+        return self.tagFile.parseSection(self.start, self.end).get(key, default)
+
+
+    def keys(self):
+        '''
+            Returns the list of field names of this section in the order they appear.
+        '''
+        return self.tagFile.parseSection(self.start, self.end).keys()
+
+
+    def __str__(self):
+        return self.tagFile.data[self.start:self.end].decode('utf-8', 'replace')
+
+
+    def __lt__(self, other):
+        return str(self) < str(other)
+
+
+    def __reduce__(self):
+        # the mapping can't be pickled, so we transfer the textual representation instead.
+        return (str, (str(self),))
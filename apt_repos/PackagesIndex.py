@@ -0,0 +1,179 @@
+#!/usr/bin/python3 -Es
+# -*- coding: utf-8 -*-
+##################################################################################
+# Access information about binary and source packages in multiple
+# (independent) apt-repositories utilizing libapt / python-apt/
+# apt_pkg without the need to change the local system and it's apt-setup.
+#
+# Copyright (C) 2017  Christoph Lutz
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+import os
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+
+class PackagesIndex:
+    '''
+        A PackagesIndex maps binary package names to the keys (name, architecture) of
+        the corresponding packages in an apt_pkg.Cache and source package names to the
+        keys (name, architecture, version) of the binary package versions built from them.
+        It allows us to answer queries for exact package names by keyed access to the
+        apt_pkg.Cache instead of iterating over all packages of a suite and to resolve
+        source names without looking up the (expensive) apt_pkg.PackageRecords.
+
+        A PackagesIndex is bound to a fingerprint of the apt lists it was built from.
+        It is persisted in a json file and can be reused as long as the fingerprint
+        of the lists doesn't change.
+    '''
+
+    FORMAT = 2
+
+    def __init__(self, fingerprint, binaries, sources):
+        '''
+            Creates a new PackagesIndex:
+
+            fingerprint: A json compatible value describing the state of the apt lists
+                         this index was built from.
+
+            binaries: dict that maps a binary package name to the list of architectures
+                      this package is available for.
+
+            sources: dict that maps a source package name to a list of [name, architecture, version]
+                     triples of the binary package versions built from this source.
+        '''
+        self.fingerprint = fingerprint
+        self.binaries = binaries
+        self.sources = sources
+        self.versionToSource = None
+        self.sortedPackageNames = None
+        self.sortedSourceNames = None
+
+
+    @staticmethod
+    def build(cache, lookupSource, fingerprint):
+        '''
+            This factory-method creates a new PackagesIndex by iterating once over all
+            packages and versions in the apt_pkg.Cache cache. lookupSource is a callable
+            (pkg, version) --> sourceName that resolves the source name of a version.
+        '''
+        logger.debug("building packages index")
+        binaries = dict()
+        sources = dict()
+        for pkg in cache.packages:
+            archs = binaries.setdefault(pkg.name, list())
+            if not pkg.architecture in archs:
+                archs.append(pkg.architecture)
+            for v in pkg.version_list:
+                sources.setdefault(lookupSource(pkg, v), list()).append([pkg.name, pkg.architecture, v.ver_str])
+        return PackagesIndex(fingerprint, binaries, sources)
+
+
+    @staticmethod
+    def load(filename, fingerprint):
+        '''
+            This factory-method reads a PackagesIndex from the json file filename.
+            It returns None if the file doesn't exist, is unreadable or if the stored
+            index was built for another fingerprint.
+        '''
+        try:
+            with open(filename, 'r') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.debug("Ignoring unreadable packages index {}: {}".format(filename, e))
+            return None
+        if data.get('Format') != PackagesIndex.FORMAT or data.get('Fingerprint') != fingerprint:
+            logger.debug("packages index {} is outdated".format(filename))
+            return None
+        return PackagesIndex(fingerprint, data['Binaries'], data['Sources'])
+
+
+    def save(self, filename):
+        '''
+            Writes this PackagesIndex to the json file filename. The file is replaced
+            atomically, so concurrent readers either see the old or the new index.
+        '''
+        data = {
+            'Format': PackagesIndex.FORMAT,
+            'Fingerprint': self.fingerprint,
+            'Binaries': self.binaries,
+            'Sources': self.sources
+        }
+        tmpFile = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(tmpFile, 'w') as fh:
+                json.dump(data, fh, separators=(',', ':'))
+            os.replace(tmpFile, filename)
+        except OSError as e:
+            logger.warning("Could not write packages index {}: {}".format(filename, e))
+
+
+    def getPackageKeys(self, name):
+        '''
+            Returns a list of (name, architecture) keys of the binary packages with the name name.
+        '''
+        return [(name, arch) for arch in self.binaries.get(name, [])]
+
+
+    def getVersionKeysBySource(self, source):
+        '''
+            Returns a list of (name, architecture, version) keys of the binary package
+            versions that were built from the source package source.
+        '''
+        return [tuple(key) for key in self.sources.get(source, [])]
+
+
+    def getSourceNames(self):
+        '''
+            Returns all source package names known by this index.
+        '''
+        return self.sources.keys()
+
+
+    def getSortedPackageNames(self):
+        '''
+            Returns the sorted list of all binary package names known by this index.
+        '''
+        if self.sortedPackageNames == None:
+            self.sortedPackageNames = sorted(self.binaries.keys())
+        return self.sortedPackageNames
+
+
+    def getSortedSourceNames(self):
+        '''
+            Returns the sorted list of all source package names known by this index.
+        '''
+        if self.sortedSourceNames == None:
+            self.sortedSourceNames = sorted(self.sources.keys())
+        return self.sortedSourceNames
+
+
+    def getSource(self, name, arch, version):
+        '''
+            Returns the name of the source package the binary package version described by
+            name, arch and version was built from or None if the version is not indexed.
+        '''
+        if self.versionToSource == None:
+            self.versionToSource = dict()
+            for source, keys in self.sources.items():
+                for (n, a, v) in keys:
+                    self.versionToSource[(n, a, v)] = source
+        return self.versionToSource.get((name, arch, version))
@@ -0,0 +1,139 @@
+#!/usr/bin/python3 -Es
+# -*- coding: utf-8 -*-
+##################################################################################
+# Access information about binary and source packages in multiple
+# (independent) apt-repositories utilizing libapt / python-apt/
+# apt_pkg without the need to change the local system and it's apt-setup.
+#
+# Copyright (C) 2017  Christoph Lutz
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+import logging
+import re
+import bisect
+
+logger = logging.getLogger(__name__)
+
+
+class PatternMatcher:
+    '''
+        A PatternMatcher combines the list of regular expressions of a --regex query into
+        one compiled matcher, so each name is searched only once and not once per pattern.
+        It also knows the literal prefixes of anchored patterns (e.g. "lib" for "^lib")
+        which allow to select candidate names from a sorted list of names via bisection
+        instead of searching all names (see selectByPrefixes(...)).
+    '''
+
+    METACHARS = ".^$*+?{}[]()|\\"
+
+    def __init__(self, patterns):
+        '''
+            Creates a PatternMatcher for the list of regular expressions patterns.
+            Raises re.error if one of the patterns is not a valid regular expression.
+        '''
+        self.patterns = list(patterns)
+        compiled = [re.compile(p) for p in self.patterns]
+        self.prefixes = [None if c.flags & re.IGNORECASE else PatternMatcher.getLiteralPrefix(p)
+                         for p, c in zip(self.patterns, compiled)]
+        self.compiled = compiled
+        self.combined = None
+        # Patterns with own groups (maybe referenced by backreferences) or flags
+        # can't be combined without changing their meaning.
+        if len(compiled) > 1 and all(c.groups == 0 and c.flags == re.compile("").flags for c in compiled):
+            try:
+                self.combined = re.compile("|".join("(?P<p{}>{})".format(x, p) for x, p in enumerate(self.patterns)))
+            except re.error as e:
+                logger.debug("Can't combine the patterns {}: {}".format(self.patterns, e))
+
+
+    def search(self, name):
+        '''
+            Returns the index of a pattern that matches name (as re.search(...) does)
+            or None if no pattern matches.
+        '''
+        if self.combined:
+            m = self.combined.search(name)
+            return int(m.lastgroup[1:]) if m else None
+        for x, pattern in enumerate(self.compiled):
+            if pattern.search(name):
+                return x
+        return None
+
+
+    def matches(self, name):
+        '''
+            Returns True if at least one of the patterns matches name.
+        '''
+        return self.search(name) != None
+
+
+    def getPrefixes(self):
+        '''
+            Returns the list of literal prefixes (one for each pattern) that a name must start
+            with in order to be matched or None if at least one pattern has no literal prefix.
+        '''
+        if any(prefix == None for prefix in self.prefixes):
+            return None
+        return list(self.prefixes)
+
+
+    @staticmethod
+    def getLiteralPrefix(pattern):
+        '''
+            Returns the literal prefix of the regular expression pattern that each matched
+            string must start with (e.g. "python3-" for "^python3-.*") or None if pattern
+            is not anchored at the beginning or if no such prefix could be determined.
+        '''
+        if not pattern.startswith("^") or "|" in pattern:
+            return None
+        prefix = ""
+        x = 1
+        while x < len(pattern):
+            c = pattern[x]
+            step = 1
+            if c == "\\":
+                if x + 1 < len(pattern) and not pattern[x + 1].isalnum():
+                    c = pattern[x + 1]
+                    step = 2
+                else:
+                    break
+            elif c in PatternMatcher.METACHARS:
+                break
+            following = pattern[x + step] if x + step < len(pattern) else ""
+            if following in "*?{" and following != "":
+                break # c is optional
+            prefix += c
+            x += step
+        return prefix if prefix else None
+
+
+    @staticmethod
+    def selectByPrefixes(sortedNames, prefixes):
+        '''
+            Yields the names of the sorted list sortedNames that start with at least one
+            of the prefixes (each name is yielded only once and in sorted order).
+        '''
+        prefixes = sorted(set(prefixes))
+        # drop prefixes that are already covered by a shorter prefix
+        reduced = list()
+        for prefix in prefixes:
+            if not reduced or not prefix.startswith(reduced[-1]):
+                reduced.append(prefix)
+        for prefix in reduced:
+            x = bisect.bisect_left(sortedNames, prefix)
+            while x < len(sortedNames) and sortedNames[x].startswith(prefix):
+                yield sortedNames[x]
+                x += 1
@@ -0,0 +1,192 @@
+#!/usr/bin/python3 -Es
+# -*- coding: utf-8 -*-
+##################################################################################
+# Access information about binary and source packages in multiple
+# (independent) apt-repositories utilizing libapt / python-apt/
+# apt_pkg without the need to change the local system and it's apt-setup.
+#
+# Copyright (C) 2017  Christoph Lutz
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+import logging
+import os
+import sys
+import functools
+from apt_repos.PackageField import PackageField
+from apt_repos.Priority import Priority
+
+logger = logging.getLogger(__name__)
+
+
+class QueryPlan:
+    '''
+        A QueryPlan is the compiled form of a list of requested PackageFields. It holds
+        one extractor callable per requested field (in the requested order), so the
+        decision how to retrieve a field is made once per query and not once per result.
+        Data that are constant for a suite (e.g. the repository url) are bound to the
+        extractors at compile time. Values of fields with only a few distinct values
+        (e.g. architectures and sections) are interned, so that all QueryResults share
+        the same string objects for them.
+
+        Use forBinaryPackages(...) or forSourcePackages(...) to compile a QueryPlan and
+        extract(...) to collect the data tuple of a QueryResult.
+    '''
+
+    def __init__(self, fields, extractors, needsRecord):
+        '''
+            Creates a new QueryPlan:
+
+            fields: List of type PackageField that describes the fields of the QueryResults.
+
+            extractors: tuple of callables (one for each field) that retrieve the field-value
+                        from the arguments passed to extract(...).
+
+            needsRecord: True if at least one extractor reads the (expensive) apt_pkg.PackageRecords
+        '''
+        self.fields = fields
+        self.extractors = extractors
+        self.needsRecord = needsRecord
+
+
+    def extract(self, *args):
+        '''
+            Returns the tuple of field-values for the arguments args. The expected arguments
+            depend on the factory-method that created this QueryPlan.
+        '''
+        return tuple(extractor(*args) for extractor in self.extractors)
+
+
+    @staticmethod
+    def forBinaryPackages(requestedFields, suite):
+        '''
+            This factory-method compiles a QueryPlan for binary packages of the RepoSuite suite.
+            The extractors of the resulting plan expect the arguments (pkg, version, curRecord, source)
+            as described in QueryResult.createByAptPkgStructures(...). curRecord is only read
+            (and must only be positioned to the version) if needsRecord is True.
+        '''
+        if type(requestedFields) == str:
+            requestedFields = PackageField.getByFieldsString(requestedFields)
+        repoUrl = QueryPlan.__getRepoUrl(requestedFields, suite)
+        extractors = list()
+        needsRecord = False
+        for field in requestedFields:
+            if field == PackageField.BINARY_PACKAGE_NAME:
+                extractors.append(lambda pkg, version, curRecord, source: pkg.name)
+            elif field == PackageField.VERSION:
+                extractors.append(lambda pkg, version, curRecord, source: version.ver_str)
+            elif field == PackageField.ARCHITECTURE:
+                extractors.append(lambda pkg, version, curRecord, source: QueryPlan.__intern(version.arch))
+            elif field == PackageField.SECTION:
+                extractors.append(lambda pkg, version, curRecord, source: QueryPlan.__intern(version.section))
+            elif field == PackageField.PRIORITY:
+                extractors.append(lambda pkg, version, curRecord, source: Priority.getByInt(version.priority))
+            elif field == PackageField.SIZE:
+                extractors.append(lambda pkg, version, curRecord, source: version.size)
+            elif field == PackageField.SOURCE_PACKAGE_NAME:
+                extractors.append(lambda pkg, version, curRecord, source: source)
+            elif field == PackageField.SUITE:
+                extractors.append(lambda pkg, version, curRecord, source: suite)
+            elif field == PackageField.PHYSICAL_COMPONENT:
+                extractors.append(lambda pkg, version, curRecord, source: QueryPlan.__getPhysicalComponent(curRecord.filename))
+                needsRecord = True
+            elif field == PackageField.LONG_DESC:
+                extractors.append(lambda pkg, version, curRecord, source: curRecord.long_desc)
+                needsRecord = True
+            elif field == PackageField.RECORD:
+                extractors.append(lambda pkg, version, curRecord, source: curRecord.record)
+                needsRecord = True
+            elif field == PackageField.BASE_URL:
+                baseUrl = os.path.join(repoUrl, "")
+                extractors.append(lambda pkg, version, curRecord, source: baseUrl)
+            elif field == PackageField.FILENAME:
+                extractors.append(lambda pkg, version, curRecord, source: os.path.join(repoUrl, curRecord.filename))
+                needsRecord = True
+        return QueryPlan(requestedFields, tuple(extractors), needsRecord)
+
+
+    @staticmethod
+    def forSourcePackages(requestedFields, suite):
+        '''
+            This factory-method compiles a QueryPlan for source packages of the RepoSuite suite.
+            The extractors of the resulting plan expect the argument (source) which is a section
+            of a Sources file as described in QueryResult.createBySourcesTagFileSection(...).
+        '''
+        if type(requestedFields) == str:
+            requestedFields = PackageField.getByFieldsString(requestedFields)
+        repoUrl = QueryPlan.__getRepoUrl(requestedFields, suite)
+        extractors = list()
+        for field in requestedFields:
+            if field == PackageField.SOURCE_PACKAGE_NAME:
+                extractors.append(lambda source: source['Package'])
+            elif field == PackageField.VERSION:
+                extractors.append(lambda source: source['Version'])
+            elif field == PackageField.SECTION:
+                extractors.append(lambda source: QueryPlan.__intern(source['Section']))
+            elif field == PackageField.PRIORITY:
+                extractors.append(lambda source: Priority.getByName(source['Priority']))
+            elif field == PackageField.ARCHITECTURE: # not a final solution!
+                extractors.append(lambda source: QueryPlan.__intern(",".join(sorted(source['Architecture'].split(" ")))))
+            elif field == PackageField.SUITE:
+                extractors.append(lambda source: suite)
+            elif field == PackageField.PHYSICAL_COMPONENT:
+                extractors.append(lambda source: QueryPlan.__getPhysicalComponent(source.get('Directory')))
+            elif field == PackageField.RECORD:
+                extractors.append(lambda source: source)
+            elif field == PackageField.BASE_URL:
+                baseUrl = os.path.join(repoUrl, "")
+                extractors.append(lambda source: baseUrl)
+            elif field == PackageField.FILENAME:
+                extractors.append(lambda source: QueryPlan.__getDscUrl(repoUrl, source))
+            else:
+                extractors.append(functools.partial(QueryPlan.__unsupportedForSources, field))
+        return QueryPlan(requestedFields, tuple(extractors), False)
+
+
+    @staticmethod
+    def __getRepoUrl(requestedFields, suite):
+        '''
+            Returns the repository url of the suite if it is required by requestedFields
+        '''
+        if PackageField.BASE_URL in requestedFields or PackageField.FILENAME in requestedFields:
+            return suite.getRepoUrl()
+        return None
+
+
+    @staticmethod
+    def __getPhysicalComponent(path):
+        parts = str(path).split("/")
+        if len(parts) > 2 and parts[0] == "pool":
+            return sys.intern(parts[1])
+        return "unknown"
+
+
+    @staticmethod
+    def __intern(value):
+        return sys.intern(value) if type(value) == str else value
+
+
+    @staticmethod
+    def __getDscUrl(repoUrl, source):
+        for f in source['Files'].split("\n"):
+            (unused_md5, unused_size, fname) = f.strip().split(" ")
+            if fname.endswith(".dsc"):
+                return os.path.join(repoUrl, source['Directory'], fname)
+        return None
+
+
+    @staticmethod
+    def __unsupportedForSources(field, source):
+        raise Exception('Package Field \'{}\' (or column character \'{}\') is not supported for source packages'.format(field.name, field.getChar()))
@@ -22,10 +22,12 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 ##################################################################################
 import logging
-import os
+import re
+import functools
 import apt_pkg
 from apt_repos.PackageField import PackageField
 from apt_repos.Priority import Priority
+from apt_repos.QueryPlan import QueryPlan
 
 logger = logging.getLogger(__name__)
 
@@ -36,21 +38,40 @@ class QueryResult:
         in the order they were requested. This order is also relevant for sorting.
         A QueryResult is hashable which makes it possible to accumulate QueryResults by
         the requestedFields.
+        The order of QueryResults is defined by their sort key (see getSortKey()), so
+        sorting many QueryResults should be done by sorted(results, key=QueryResult.getSortKey).
+        Since queries may return millions of QueryResults, they are kept compact: they have
+        no __dict__ and all QueryResults of a query share the same fields.
     '''
-    
+
+    __slots__ = ('fields', 'data', 'sortKey')
+
+    # splits a version fragment into alternating runs of non-digits and digits
+    __fragmentRE = re.compile(r'([0-9]+)')
+
+    # translates the (ascii) chars of non-digit runs of a version into chars that compare
+    # like apt does: '~' sorts before the end of the run ('\x02'), the end of the run
+    # before letters and letters before all other chars
+    __charOrders = { c: 1 if chr(c) == '~' else c if chr(c).isalpha() else c + 256 for c in range(128) }
+
+    # the fields and their key functions of the last call to __getSortKeyFunctions(...)
+    __lastSortKeyFunctions = (None, None)
+
     def __init__(self, fields, data):
         '''
             This constructor creates a QueryResult for the list of PackageField fields
             and their corresponding field-data (as a tuple)
             
             fields: List of type PackageField that describes which fields
-                             this QueryResult should carry.
+                             this QueryResult should carry. The list is not copied, so
+                             it can (and should) be shared by all QueryResults of a query.
                              
             data: tuple of values for each of the fields
         '''
         self.fields = fields
         self.data = data
-        
+        self.sortKey = None
+
         
     @staticmethod
     def createByAptPkgStructures(requestedFields, pkg, version, curRecord, suite, source):
@@ -75,43 +96,12 @@ class QueryResult:
                     Since I'am not quite clear, if this is the only reason for
                     curRecord.source_pkg to be empty, we force the caller to provide
                     the exact source name directly).
+
+            If many QueryResults are created for the same requestedFields, it is more efficient
+            to compile a QueryPlan once (see QueryPlan.forBinaryPackages(...)) and to reuse it.
         '''
-        data = list()        
-        if type(requestedFields) == str:
-            requestedFields = PackageField.getByFieldsString(requestedFields)
-        for field in requestedFields:
-            if field == PackageField.BINARY_PACKAGE_NAME:
-                data.append(pkg.name)
-            elif field == PackageField.VERSION:
-                data.append(version.ver_str)
-            elif field == PackageField.ARCHITECTURE:
-                data.append(version.arch)
-            elif field == PackageField.SECTION:
-                data.append(version.section)
-            elif field == PackageField.PRIORITY:
-                data.append(Priority.getByInt(version.priority))
-            elif field == PackageField.SIZE:
-                data.append(version.size)
-            elif field == PackageField.SOURCE_PACKAGE_NAME:
-                data.append(source)
-            elif field == PackageField.SUITE:
-                data.append(suite)        
-            elif field == PackageField.PHYSICAL_COMPONENT:
-                parts = str(curRecord.filename).split("/")
-                if len(parts) > 2 and parts[0] == "pool":
-                    data.append(parts[1])
-                else:
-                    data.append("unknown")
-            elif field == PackageField.LONG_DESC:
-                data.append(curRecord.long_desc)        
-            elif field == PackageField.RECORD:
-                data.append(curRecord.record)        
-            elif field == PackageField.BASE_URL:
-                data.append(os.path.join(suite.getRepoUrl(), ""))
-            elif field == PackageField.FILENAME:
-                data.append(os.path.join(suite.getRepoUrl(), curRecord.filename))
-        data = tuple(data)
-        return QueryResult(requestedFields, data)
+        plan = QueryPlan.forBinaryPackages(requestedFields, suite)
+        return QueryResult(plan.fields, plan.extract(pkg, version, curRecord, source))
 
 
     @staticmethod
@@ -129,48 +119,12 @@ class QueryResult:
                     file <sourceFile> (see apt_pkg docs).
 
             suite: The RepoSuite object
+
+            If many QueryResults are created for the same requestedFields, it is more efficient
+            to compile a QueryPlan once (see QueryPlan.forSourcePackages(...)) and to reuse it.
         '''
-        data = list()
-        if type(requestedFields) == str:
-            requestedFields = PackageField.getByFieldsString(requestedFields)
-        for field in requestedFields:
-            if field == PackageField.SOURCE_PACKAGE_NAME:
-                data.append(source['Package'])
-            elif field == PackageField.VERSION:
-                data.append(source['Version'])
-            elif field == PackageField.SECTION:
-                data.append(source['Section'])
-            elif field == PackageField.PRIORITY:
-                data.append(Priority.getByName(source['Priority']))
-            elif field == PackageField.ARCHITECTURE: # not a final solution!
-                data.append(",".join(sorted(source['Architecture'].split(" "))))
-            elif field == PackageField.SUITE:
-                data.append(suite)
-            elif field == PackageField.PHYSICAL_COMPONENT:
-                parts = str(source.get('Directory')).split("/")
-                if len(parts) > 2 and parts[0] == "pool":
-                    data.append(parts[1])
-                else:
-                    data.append("unknown")
-            elif field == PackageField.RECORD:
-                data.append(source)
-            elif field == PackageField.BASE_URL:
-                data.append(os.path.join(suite.getRepoUrl(), ""))
-            elif field == PackageField.FILENAME:
-                dscFile = None
-                for f in source['Files'].split("\n"):
-                    (unused_md5, unused_size, fname) = f.strip().split(" ")
-                    if fname.endswith(".dsc"):
-                        dscFile = fname
-                        break
-                if dscFile:
-                    data.append(os.path.join(suite.getRepoUrl(), source['Directory'], dscFile))
-                else:
-                    data.append(None)
-            else:
-                raise Exception('Package Field \'{}\' (or column character \'{}\') is not supported for source packages'.format(field.name, field.getChar()))
-        data = tuple(data)
-        return QueryResult(requestedFields, data)
+        plan = QueryPlan.forSourcePackages(requestedFields, suite)
+        return QueryResult(plan.fields, plan.extract(source))
 
 
     def getData(self):
@@ -184,6 +138,13 @@ class QueryResult:
         return iter(self.data)
 
 
+    def __reduce__(self):
+        # apt_pkg.TagSection objects (the Full-Record of source packages) can't be
+        # pickled, so we transfer their textual representation instead.
+        data = tuple(str(d) if isinstance(d, apt_pkg.TagSection) else d for d in self.data)
+        return (QueryResult, (self.fields, data))
+
+
     def __hash__(self):
         return hash((tuple(self.data), tuple(self.fields)))
 
@@ -198,15 +159,89 @@ class QueryResult:
         return not(self == other)
 
 
+    def getSortKey(self):
+        '''
+            This method returns a tuple that defines the order of this QueryResult compared to
+            other QueryResults with the same fields: The fields are compared in the order they
+            were requested, versions are compared like apt_pkg.version_compare(...) does, suites
+            by their ordervalue and priorities by their int value. The key is computed once
+            and then kept with this QueryResult.
+        '''
+        if self.sortKey == None:
+            keyFunctions = QueryResult.__getSortKeyFunctions(self.fields)
+            self.sortKey = tuple([f(d) if f else d for f, d in zip(keyFunctions, self.data)])
+        return self.sortKey
+
+
+    @staticmethod
+    def __getSortKeyFunctions(fields):
+        # all results of a query share the same fields, so we remember the last ones
+        (lastFields, keyFunctions) = QueryResult.__lastSortKeyFunctions
+        if fields is not lastFields and fields != lastFields:
+            keyFunctions = list()
+            for field in fields:
+                if field == PackageField.VERSION:
+                    keyFunctions.append(QueryResult.getVersionKey)
+                elif field == PackageField.SUITE:
+                    keyFunctions.append(lambda suite: getattr(suite, 'sortKey', suite))
+                elif field == PackageField.PRIORITY:
+                    keyFunctions.append(lambda priority: priority.value if isinstance(priority, Priority) else priority)
+                elif field == PackageField.RECORD:
+                    keyFunctions.append(str)
+                else:
+                    keyFunctions.append(None) # compared by value
+            QueryResult.__lastSortKeyFunctions = (fields, keyFunctions)
+        return keyFunctions
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def getVersionKey(version):
+        '''
+            This method returns a tuple for the debian version string version. Comparing two
+            of these tuples gives the same result as apt_pkg.version_compare(...) for the
+            corresponding version strings, but without calling into apt_pkg for each comparison.
+        '''
+        # Like apt, we ignore a leading ':' or '-', treat a zero epoch like no epoch
+        # and a missing revision like the revision '0'. Non-ascii chars are compared
+        # bytewise (as apt does for their utf-8 encoding).
+        if not version.isascii():
+            version = version.encode("utf-8").decode("latin-1")
+        (epoch, sep, upstream) = version.partition(":")
+        if sep and epoch:
+            epoch = epoch.lstrip("0")
+        else:
+            (epoch, upstream) = ("", version)
+        (upstreamPart, sep, revision) = upstream.rpartition("-")
+        if not sep:
+            revision = "0"
+        elif not upstreamPart:
+            (upstream, revision) = ("", "0")
+        else:
+            upstream = upstreamPart
+        return (QueryResult.__getFragmentKey(epoch),
+                QueryResult.__getFragmentKey(upstream),
+                QueryResult.__getFragmentKey(revision))
+
+
+    @staticmethod
+    def __getFragmentKey(fragment):
+        # Like apt, we compare alternating runs of non-digits (char by char, see __charOrders)
+        # and digits (numerically, a missing run counts as 0). An empty fragment
+        # sorts after fragments starting with '~' and before all other fragments.
+        if not fragment:
+            return ("\x02", -1)
+        runs = QueryResult.__fragmentRE.split(fragment)
+        key = [int(run) if i % 2 else run.translate(QueryResult.__charOrders) + "\x02" for i, run in enumerate(runs)]
+        if runs[-1]:
+            key.extend([0, "\x02"])
+        return tuple(key)
+
+
     def __lt__(self, other):
         if self.fields != other.fields:
             raise Exception('We can only compare QueryResults with the same fields-order.')
-        for field, a, b in zip(self.fields, self.data, other.data):
-            if field == PackageField.VERSION and a != b:
-                return True if apt_pkg.version_compare(a, b) < 0 else False
-            elif a != b:
-                return a < b
-        return False
+        return self.getSortKey() < other.getSortKey()
     
     
     def __str__(self):
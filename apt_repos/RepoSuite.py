@@ -26,12 +26,20 @@ import sys
 import logging
 import re
 import json
+import time
+import bisect
 
 import apt_pkg
-import apt.progress
 import functools
+from urllib.parse import urlparse
 
+import apt_repos
 from apt_repos.QueryResult import QueryResult
+from apt_repos.QueryPlan import QueryPlan
+from apt_repos.PatternMatcher import PatternMatcher
+from apt_repos.SourcesIndex import SourcesIndex
+from apt_repos.MappedTagFile import MappedTagFile
+from apt_repos.PackagesIndex import PackagesIndex
 
 logger = logging.getLogger(__name__)
 
@@ -45,16 +53,19 @@ class RepoSuite:
     
         Note: RepoSuite can be used single threaded only! This is because apt_pkg can only
               be configured to have one root-context at a time. This root-context is set by scan(...)
+              If you want to process multiple suites in parallel, use separate processes (each
+              with it's own apt_pkg context) e.g. via apt_repos.forEachSuite(...).
     '''
 
     def __init__(self, baseDir, cacheDir, suiteDesc, ordervalue):
         '''
-            Initializes the suite and creates the caching structure. 
+            Initializes the suite. The caching structure is created on the first scan(...).
             Note: The apt-cache is not scanned and not updated there! 
                   Always call scan(...) before accessing package metadata!
         '''
         self.suite = suiteDesc['Suite']
         self.ordervalue = ordervalue        
+        self.sortKey = (ordervalue, self.suite)
         self.basedir = baseDir
         self.rootdir = os.path.realpath(cacheDir + '/' + self.suite.replace("/", "^"))
         self.sourcesListEntry = suiteDesc['SourcesList']
@@ -63,9 +74,28 @@ class RepoSuite:
         self.trustedGPGFile = suiteDesc.get('TrustedGPG')
         self.tags = suiteDesc["Tags"] if suiteDesc.get("Tags") else []
         self.description = suiteDesc.get('Description', '')
-
-
-        # create caching structure
+        self._cache = None
+        self._records = None
+        self.cacheFingerprint = None
+        self.maxAge = None
+        try:
+            self.maxAge = RepoSuite.parseMaxAge(suiteDesc.get('MaxAge'))
+        except ValueError as e:
+            logger.warning("Ignoring invalid MaxAge for suite {}: {}".format(self.suite, e))
+        self.packagesIndex = None
+        self.sourcesIndex = None
+        self.sourceNames = None
+        self.rootdirPrepared = False
+
+
+    def _prepareRootdir(self):
+        '''
+            Creates the caching structure of this suite in self.rootdir and ensures that the
+            config files are properly configured. This is done on the first scan(...) or
+            update() only, so RepoSuites are cheap to create, e.g. for just listing suites.
+        '''
+        if self.rootdirPrepared:
+            return
         dirs = [ "/etc/apt", "/var/lib/dpkg", "/var/cache/apt/archives/partial", "/var/lib/apt/lists/partial" ]
         for dir in dirs:
             fullDir = self.rootdir + dir
@@ -82,7 +112,8 @@ class RepoSuite:
         if self.trustedGPGFile:
             self._ensureFileContent(self.rootdir + "/etc/apt/trusted.gpg", self.getTrustedGPG())
         self._ensureFileContent(self.rootdir + "/var/lib/dpkg/status", "")
-        
+        self.rootdirPrepared = True
+
 
     def _ensureFileContent(self, file, content):
         '''
@@ -111,31 +142,164 @@ class RepoSuite:
             This method sets the (global) apt-context to this suite and updates the repository
             metadata in the local cache from the remote apt-repository if update==True.
             Call this method before accessing packages data, e.g. like in queryPackages(...).
-            If update==False, the already cached local metadata are used. This method
+            If update==False or if the cached metadata are still fresh according to the
+            suite's MaxAge (see isUpToDate()), the already cached local metadata are used. This method
             returns False if apt-pkg recognized an error during scan (it seems apt-pkg doesn't
             recognize all error situations, i.e. if a repository server is not available).
         '''  
         logger.debug("scanning repository/suite {} {} update".format(self.suite, 'with' if update else 'without'))
-        apt_pkg.read_config_file(apt_pkg.config, self.rootdir + "/etc/apt/apt.conf")                
-        apt_pkg.config.set("Dir", self.rootdir)
-        apt_pkg.config.set("Dir::State::status", self.rootdir + "/var/lib/dpkg/status")
-        apt_pkg.init_system()
-        self.cache = apt_pkg.Cache()
+        self._prepareRootdir()
         ok = True
+        if update and self.isUpToDate():
+            logger.debug("skipping update of suite {} as it's lists are younger than {}s".format(self.suite, self.maxAge))
+            update = False
         if update:
-            try:
-                self.cache.update(self.__Progress(), self.__sources())
-            except SystemError as e:
-                logger.warning("Could not update the cache for suite {}:".format(self.suite))
-                for msg in re.sub(r"(\n,)? ([WE]:)", "\n\\2", str(e)).split("\n"):
-                    logger.warning(msg)
-                ok = False
-            self.cache = apt_pkg.Cache()
-        self.records = apt_pkg.PackageRecords(self.cache)
+            ok = len(self.update()) == 0
+        else:
+            self._setAptContext()
+        fingerprint = self._getListsFingerprint()
+        if fingerprint == self.cacheFingerprint:
+            logger.debug("lists of suite {} are unchanged --> reusing the package cache".format(self.suite))
+        else:
+            self.__resetCache(fingerprint)
         logger.debug("finished scan")
         return ok
-        
-    
+
+
+    def update(self):
+        '''
+            This method sets the (global) apt-context to this suite and updates the repository
+            metadata in the local cache from the remote apt-repository. In contrast to scan(True)
+            the package cache required for queries is not rebuilt after the update. This method returns
+            the list of error messages reported by apt-pkg (an empty list if the update succeeded).
+        '''
+        logger.debug("updating repository/suite {}".format(self.suite))
+        self._prepareRootdir()
+        progress = RepoSuite.__newProgress()
+        self._setAptContext()
+        fingerprint = self._getListsFingerprint()
+        if fingerprint != self.cacheFingerprint:
+            # the cache used for the update could be reused by scan() if the lists don't change
+            self.__resetCache(fingerprint)
+        errors = list()
+        try:
+            with apt_repos.silenced_stdout_channel():
+                self.cache.update(progress, self.__sources())
+        except SystemError as e:
+            logger.warning("Could not update the cache for suite {}:".format(self.suite))
+            for msg in re.sub(r"(\n,)? ([WE]:)", "\n\\2", str(e)).split("\n"):
+                logger.warning(msg)
+                errors.append(msg)
+        if len(errors) == 0:
+            self.__touchLastUpdate()
+        return errors
+
+
+    def __resetCache(self, fingerprint):
+        '''
+            Drops the apt_pkg.Cache and all data derived from it. The cache for the lists
+            described by fingerprint (see _getListsFingerprint()) is built on first access.
+        '''
+        self._cache = None
+        self._records = None
+        self.cacheFingerprint = fingerprint
+        self.packagesIndex = None
+        self.sourcesIndex = None
+        self.sourceNames = None
+
+
+    @property
+    def cache(self):
+        '''
+            The apt_pkg.Cache of the lists found during the last scan(...). The cache is
+            built on first access, so queries that only read the Sources files (e.g.
+            querySources(...)) don't need to parse the binary Packages files.
+        '''
+        if self._cache == None:
+            if self.cacheFingerprint == None:
+                raise SystemError("suite {} needs to be scanned before accessing the package cache".format(self.suite))
+            logger.debug("building the package cache for suite {}".format(self.suite))
+            self._setAptContext()
+            with apt_repos.silenced_stdout_channel():
+                self._cache = apt_pkg.Cache()
+        return self._cache
+
+
+    @property
+    def records(self):
+        '''
+            The apt_pkg.PackageRecords of self.cache (also built on first access)
+        '''
+        if self._records == None:
+            self._records = apt_pkg.PackageRecords(self.cache)
+        return self._records
+
+
+    def isUpToDate(self):
+        '''
+            Returns True if a MaxAge is defined for this suite and the last successful
+            update of the suite's lists is younger than MaxAge seconds (and not older
+            than the current sources.list configuration).
+        '''
+        if self.maxAge == None:
+            return False
+        try:
+            lastUpdate = os.stat(self.__lastUpdateFile()).st_mtime
+            lastConfigChange = os.stat(self.rootdir + "/etc/apt/sources.list").st_mtime
+        except OSError:
+            return False
+        return lastUpdate >= lastConfigChange and time.time() - lastUpdate < self.maxAge
+
+
+    def __lastUpdateFile(self):
+        return self.rootdir + "/var/lib/apt-repos/last-update"
+
+
+    def __touchLastUpdate(self):
+        filename = self.__lastUpdateFile()
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w"):
+                pass
+        except OSError as e:
+            logger.warning("Could not write {}: {}".format(filename, e))
+
+
+    @staticmethod
+    def parseMaxAge(value):
+        '''
+            Converts a MaxAge value into a number of seconds. value is either a number of
+            seconds or a string consisting of a number and an optional unit s, m, h or d
+            (e.g. "15m"). Returns None if value is None and raises a ValueError if value
+            is not a valid MaxAge.
+        '''
+        if value == None:
+            return None
+        if isinstance(value, bool):
+            raise ValueError("'{}' is not a valid duration".format(value))
+        if isinstance(value, (int, float)):
+            seconds = value
+        else:
+            m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$", str(value))
+            if not m:
+                raise ValueError("'{}' is not a valid duration (expected e.g. 90s, 15m, 2h or 1d)".format(value))
+            seconds = float(m.group(1)) * { '': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400 }[m.group(2)]
+        if seconds < 0:
+            raise ValueError("'{}' is not a valid duration".format(value))
+        return int(seconds) if seconds == int(seconds) else seconds
+
+
+    def _setAptContext(self):
+        '''
+            Sets the (global) apt_pkg configuration to the cache folder of this suite
+        '''
+        apt_repos._initAptPkg()
+        apt_pkg.read_config_file(apt_pkg.config, self.rootdir + "/etc/apt/apt.conf")                
+        apt_pkg.config.set("Dir", self.rootdir)
+        apt_pkg.config.set("Dir::State::status", self.rootdir + "/var/lib/dpkg/status")
+        apt_pkg.init_system()
+
+
     def getSourcesList(self):
         '''
             Returns the sourcesList-Entry used for this repo/suite constellation
@@ -159,12 +323,21 @@ class RepoSuite:
             Returns the content of the trustedGPG-File as a string if it is set, otherwise None
         '''
         gpgFile = self.getTrustedGPGFile()
-        if gpgFile:
-            try:
-                with open(gpgFile, "rb") as fh:
-                    return fh.read()
-            except FileNotFoundError:
-                logger.warning("Ignoring not existent GPG-File {}!".format(gpgFile))
+        return RepoSuite._readTrustedGPG(gpgFile) if gpgFile else None
+
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _readTrustedGPG(gpgFile):
+        '''
+            Returns the content of the GPG-File gpgFile or None if it doesn't exist. The content
+            is read once per process and shared by all suites using the same TrustedGPG-File.
+        '''
+        try:
+            with open(gpgFile, "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            logger.warning("Ignoring not existent GPG-File {}!".format(gpgFile))
         return None
         
 
@@ -190,6 +363,14 @@ class RepoSuite:
         return url
 
 
+    def getRepoHost(self):
+        '''
+            Returns the network location (host[:port]) of the Repository-Url
+            or an empty string for local repositories (e.g. file://-Urls)
+        '''
+        return urlparse(self.getRepoUrl()).netloc
+
+
     def getDistsUrl(self):
         '''
             Returns an Url to the dists-folder for the suite in the form <REPO_URL>/dists/<SUITENAME>
@@ -245,6 +426,21 @@ class RepoSuite:
         return self.suite
 
 
+    def getMaxAge(self):
+        '''
+            Returns the maximum age (in seconds) of the cached lists up to which
+            scan(True) skips the update of this suite or None if no MaxAge is defined.
+        '''
+        return self.maxAge
+
+
+    def setMaxAge(self, maxAge):
+        '''
+            Overrides the MaxAge (in seconds) defined for this suite (see getMaxAge()).
+        '''
+        self.maxAge = maxAge
+
+
     def getTags(self):
         '''
             Returns the tags that are assigned to the suite.
@@ -260,6 +456,25 @@ class RepoSuite:
         return self.description
 
 
+    def __getstate__(self):
+        # apt_pkg objects can't be pickled. A RepoSuite transferred to another
+        # process needs to be scanned there again.
+        state = dict(self.__dict__)
+        for key in ['_cache', 'cacheFingerprint', '_records', 'packagesIndex', 'sourcesIndex', 'sourceNames']:
+            state.pop(key, None)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = None
+        self._records = None
+        self.cacheFingerprint = None
+        self.packagesIndex = None
+        self.sourcesIndex = None
+        self.sourceNames = None
+
+
     def __len__(self):
         return len(self.suite)
 
@@ -283,9 +498,7 @@ class RepoSuite:
 
 
     def __lt__(self, other):
-        if self.ordervalue != other.ordervalue:
-            return self.ordervalue < other.ordervalue
-        return self.suite < other.suite
+        return self.sortKey < other.sortKey
 
 
     def queryPackages(self, requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly=False):
@@ -313,58 +526,170 @@ class RepoSuite:
                           this list order and will accumulate the (hashable) QueryResult-Objects
                           by these fields.
         '''
-        res = set()
+        return set(self.iterPackages(requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly))
+
+
+    def iterPackages(self, requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly=False):
+        '''
+            This generator yields the QueryResults of queryPackages(...) one by one, so they can be
+            processed without collecting them in a set. The QueryResults are yielded unsorted and
+            the same QueryResult could be yielded more than once.
+        '''
         latests = dict()
-        for pkg in self.cache.packages:
+        plan = QueryPlan.forBinaryPackages(requestedFields, self)
+        index = self._getPackagesIndex()
+
+        # Determine the candidate packages and the versions matched by a source name.
+        # Source names are resolved from the index, so PackageRecords are only
+        # required if a requested field needs the record.
+        srcMatches = set()
+        if isRE:
+            matcher = PatternMatcher(requestPackages)
+            prefixes = matcher.getPrefixes()
+            for source in self._selectSourceNames(index, prefixes):
+                if matcher.matches("src:" + source):
+                    srcMatches.update(index.getVersionKeysBySource(source))
+            if prefixes != None:
+                # all patterns are anchored: only names starting with one of the prefixes could match
+                keys = set()
+                for name in PatternMatcher.selectByPrefixes(index.getSortedPackageNames(), prefixes):
+                    if matcher.matches(name):
+                        keys.update(index.getPackageKeys(name))
+                keys.update({ (n, a) for (n, a, v) in srcMatches })
+                packages = self._getPackagesByKeys(keys)
+            else:
+                packages = self.cache.packages
+        else:
+            requestNames = { req for req in requestPackages if not req.startswith("src:") }
+            keys = set()
+            for name in requestNames:
+                keys.update(index.getPackageKeys(name))
+            for req in requestPackages:
+                if req.startswith("src:"):
+                    srcMatches.update(index.getVersionKeysBySource(req[len("src:"):]))
+            keys.update({ (n, a) for (n, a, v) in srcMatches })
+            packages = self._getPackagesByKeys(keys)
+
+        for pkg in packages:
+            # the name check is cheap and needs to be done only once per package
+            if isRE:
+                nameMatched = matcher.matches(pkg.name)
+            else:
+                nameMatched = pkg.name in requestNames
+
             for v in pkg.version_list:
-                for req in requestPackages:
-                    # Get source name that could be empty in some cases, i.e. if the 
-                    # binary package name is equal to the source name. I'm not sure,
-                    # if this the only reason for an empty source name, so we check
-                    # that before we set source = pkg.name
+                if not nameMatched and not (pkg.name, pkg.architecture, v.ver_str) in srcMatches:
+                    continue
+
+                #logger.debug("Found package {}".format(pkg.name))
+
+                if (requestArchs) and (not v.arch in requestArchs):
+                    continue
+
+                parts = v.section.split("/", 1)
+                if len(parts) == 1:
+                    component, unused_section = "main", parts[0]
+                else:
+                    component, unused_section = parts
+                if (requestComponents) and (not component in requestComponents):
+                    continue
+
+                source = index.getSource(pkg.name, pkg.architecture, v.ver_str)
+                if source == None:
+                    source = self._lookupSource(pkg, v)
+                elif plan.needsRecord:
                     self.records.lookup(v.file_list[0])
-                    source = self.records.source_pkg
-                    if source == "":
-                        # last directory part of the deb-filename is the source name
-                        s = os.path.basename(os.path.dirname(self.records.filename))
-                        if pkg.name == s:
-                            source = pkg.name
-        
-                    if isRE:
-                        m = re.search(req, pkg.name)
-                        if not m:
-                            m = re.search(req, "src:" + source)
-                            if not m:
-                                continue
-                    else:
-                        if not (pkg.name == req or ("src:" + source) == req):
-                            continue
-        
-                    #logger.debug("Found package {}".format(pkg.name))
-        
-                    if (requestArchs) and (not v.arch in requestArchs):
-                        continue
-        
-                    parts = v.section.split("/", 1)
-                    if len(parts) == 1:
-                        component, unused_section = "main", parts[0]
-                    else:
-                        component, unused_section = parts
-                    if (requestComponents) and (not component in requestComponents):
-                        continue
-   
-                    package = QueryResult.createByAptPkgStructures(requestedFields, pkg, v, self.records, self, source)
-                    if latestOnly:
-                        key = "{}:{}".format(pkg.name, v.arch)
-                        latest = latests.get(key) or package
-                        if package > latest:
-                            lagest = package
-                        latests[key] = latest
-                    else:
-                        res.add(package)
+
+                package = QueryResult(plan.fields, plan.extract(pkg, v, self.records if plan.needsRecord else None, source))
+                if latestOnly:
+                    key = "{}:{}".format(pkg.name, v.arch)
+                    latest = latests.get(key) or package
+                    if package > latest:
+                        lagest = package
+                    latests[key] = latest
+                else:
+                    yield package
         for latest in latests.values():
-            res.add(latest)
-        return res
+            yield latest
+
+
+    @staticmethod
+    def _selectSourceNames(index, prefixes):
+        '''
+            Returns the source names of the PackagesIndex index that could be matched in
+            the form "src:<source>" by patterns with the literal prefixes (see PatternMatcher).
+            If prefixes is None, all source names are returned.
+        '''
+        if prefixes == None:
+            return index.getSourceNames()
+        srcPrefixes = list()
+        for prefix in prefixes:
+            if prefix.startswith("src:"):
+                srcPrefixes.append(prefix[len("src:"):])
+            elif "src:".startswith(prefix): # e.g. '^s' matches all "src:<source>" strings
+                srcPrefixes.append("")
+        return PatternMatcher.selectByPrefixes(index.getSortedSourceNames(), srcPrefixes)
+
+
+    def _getPackagesByKeys(self, keys):
+        '''
+            Returns the list of apt_pkg.Package objects for the (name, architecture) keys.
+        '''
+        return [self.cache[key] for key in sorted(keys) if key in self.cache]
+
+
+    def _getPackagesIndex(self):
+        '''
+            Returns the PackagesIndex for the currently scanned lists of this suite.
+            The index is read from the suite's cache folder if it is still valid for
+            the current lists. Otherwise it is rebuilt (once) and stored there.
+        '''
+        if self.packagesIndex:
+            return self.packagesIndex
+        fingerprint = self.cacheFingerprint
+        indexFile = self.rootdir + "/var/lib/apt-repos/packages.index"
+        self.packagesIndex = PackagesIndex.load(indexFile, fingerprint)
+        if not self.packagesIndex:
+            self.packagesIndex = PackagesIndex.build(self.cache, self._lookupSource, fingerprint)
+            self.packagesIndex.save(indexFile)
+        return self.packagesIndex
+
+
+    def _getListsFingerprint(self):
+        '''
+            Returns a json compatible fingerprint of the apt lists currently stored
+            in the suite's cache folder (filename, size and modification time of each
+            list file) together with the apt.conf that influences the package cache.
+        '''
+        listsDir = self.rootdir + "/var/lib/apt/lists/"
+        files = list()
+        for filename in sorted(os.listdir(listsDir)):
+            try:
+                st = os.stat(listsDir + filename)
+            except FileNotFoundError:
+                continue
+            if filename != "lock" and os.path.isfile(listsDir + filename):
+                files.append([filename, st.st_size, st.st_mtime_ns])
+        return [self.getAptConf(), files]
+
+
+    def _lookupSource(self, pkg, version):
+        '''
+            Positions self.records to the record of the apt_pkg.Version version
+            and returns the name of the source package pkg was built from.
+        '''
+        # Get source name that could be empty in some cases, i.e. if the
+        # binary package name is equal to the source name. I'm not sure,
+        # if this the only reason for an empty source name, so we check
+        # that before we set source = pkg.name
+        self.records.lookup(version.file_list[0])
+        source = self.records.source_pkg
+        if source == "":
+            # last directory part of the deb-filename is the source name
+            s = os.path.basename(os.path.dirname(self.records.filename))
+            if pkg.name == s:
+                source = pkg.name
+        return source
 
 
     def querySources(self, requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly=False):
@@ -391,67 +716,148 @@ class RepoSuite:
                           this list order and will accumulate the (hashable) QueryResult-Objects
                           by these fields.
         '''
-        res = set()
+        return set(self.iterSources(requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly))
 
-        sourcesFiles = self.getSourcesFiles()
-        if not sourcesFiles:
+
+    def iterSources(self, requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly=False):
+        '''
+            This generator yields the QueryResults of querySources(...) one by one, so they can be
+            processed without collecting them in a set. The QueryResults are yielded unsorted and
+            the same QueryResult could be yielded more than once.
+        '''
+        index = self.getSourcesIndex()
+        if not index:
             logger.debug("no sources files for suite {}".format(self.getSuiteName()))
-            return res
+            return
 
         latests = dict()
-        for sourcesFile in sourcesFiles: # there's one sourcesFile per component
-            # skip unrequested components:
-            # TODO: this is too much implementation specific to the apt_pkg lib... improve if possible
-            m = re.search("^.*_([^_]+)_source_Sources$", sourcesFile)
-            if not m:
+        plan = QueryPlan.forSourcePackages(requestedFields, self)
+        if isRE:
+            matcher = PatternMatcher(requestPackages)
+            prefixes = matcher.getPrefixes()
+            names = index.getSortedNames() if prefixes == None else PatternMatcher.selectByPrefixes(index.getSortedNames(), prefixes)
+            names = [name for name in names if matcher.matches(name)]
+        else:
+            names = self.filterSourceNames(requestPackages, requestComponents)
+            if len(names) == 0:
+                return
+
+        # skip unrequested components (derived from the name of the sources file)
+        entries = list()
+        for entry in index.getEntries(names):
+            (unused_name, sourcesFile, component, *unused) = entry
+            if component == None:
                 logger.warning("Sorry, I can't extract a component name from the sources file name {}".format(sourcesFile))
                 continue
-            component = m.group(1)
             if requestComponents and len(requestComponents) > 0 and not component in requestComponents:
-                logger.debug("skipping component {} as not requested in --component".format(component))
+                continue
+            entries.append(entry)
+
+        for (name, source) in self._readSourcesSections(entries):
+
+            #if (requestArchs) and (not v.arch in requestArchs):
+            #    continue
+
+            parts = source['Section'].split("/", 1)
+            if len(parts) == 1:
+                component, unused_section = "main", parts[0]
+            else:
+                component, unused_section = parts
+            if (requestComponents) and (not component in requestComponents):
                 continue
 
-            logger.debug("parsing sources file {}".format(sourcesFile))
-            with open(sourcesFile, 'r') as f:
-                with apt_pkg.TagFile(f) as tagfile:
-                    for source in tagfile:
-                        name = source['Package']
-
-                        for req in requestPackages:
-                            if isRE:
-                                m = re.search(req, name)
-                                if not m:
-                                    continue
-                            else:
-                                if not (name == req):
-                                    continue
-
-                            #logger.debug("Found package {}".format(name))
-
-                            #if (requestArchs) and (not v.arch in requestArchs):
-                            #    continue
-
-                            parts = source['Section'].split("/", 1)
-                            if len(parts) == 1:
-                                component, unused_section = "main", parts[0]
-                            else:
-                                component, unused_section = parts
-                            if (requestComponents) and (not component in requestComponents):
-                                continue
-
-                            package = QueryResult.createBySourcesTagFileSection(requestedFields, source, self)
-                            if latestOnly:
-                                latest = latests.get(name) or package
-                                if package > latest:
-                                    lagest = package
-                                latests[name] = latest
-                            else:
-                                res.add(package)
+            package = QueryResult(plan.fields, plan.extract(source))
+            if latestOnly:
+                latest = latests.get(name) or package
+                if package > latest:
+                    lagest = package
+                latests[name] = latest
+            else:
+                yield package
         for latest in latests.values():
-            res.add(latest)
+            yield latest
+
+
+    def getSourcesIndex(self):
+        '''
+            Returns the SourcesIndex for the *_Sources files of this suite (see getSourcesFiles())
+            or None if this suite has no Sources. The index is read from the suite's cache folder
+            if it is still valid for the current lists. Otherwise it is rebuilt (once) and stored there.
+        '''
+        if self.sourcesIndex:
+            return self.sourcesIndex
+        sourcesFiles = self.getSourcesFiles()
+        if not sourcesFiles:
+            return None
+        fingerprint = self.cacheFingerprint
+        indexFile = self.rootdir + "/var/lib/apt-repos/sources.index"
+        self.sourcesIndex = SourcesIndex.load(indexFile, fingerprint)
+        if not self.sourcesIndex:
+            self.sourcesIndex = SourcesIndex.build(sourcesFiles, fingerprint)
+            self.sourcesIndex.save(indexFile)
+            self.sourcesIndex.saveNames(self.rootdir + "/var/lib/apt-repos/sources.names")
+        return self.sourcesIndex
+
+
+    def getSourceNames(self):
+        '''
+            Returns a dict that maps each component of this suite's Sources (None for Sources files
+            without a derivable component) to the sorted list of source package names in it or None
+            if this suite has no Sources. The names are stored next to the SourcesIndex when it is
+            built, so they can be read without loading the (much bigger) SourcesIndex.
+        '''
+        if self.sourceNames != None:
+            return self.sourceNames
+        if not self.getSourcesFiles():
+            return None
+        namesFile = self.rootdir + "/var/lib/apt-repos/sources.names"
+        self.sourceNames = SourcesIndex.loadNames(namesFile, self.cacheFingerprint)
+        if self.sourceNames == None:
+            index = self.getSourcesIndex()
+            self.sourceNames = index.getNamesByComponent()
+            index.saveNames(namesFile)
+        return self.sourceNames
+
+
+    def filterSourceNames(self, names, requestComponents=None):
+        '''
+            Returns the list of source package names in names that are available in this suite.
+            If requestComponents is not empty, only names that are available in one of the
+            requestComponents are returned. Names in Sources files without a derivable component
+            are always returned, so that queries can report these files.
+        '''
+        sourceNames = self.getSourceNames()
+        if not sourceNames:
+            return list()
+        res = list()
+        for name in names:
+            for component, sortedNames in sourceNames.items():
+                if component != None and requestComponents and not component in requestComponents:
+                    continue
+                i = bisect.bisect_left(sortedNames, name)
+                if i < len(sortedNames) and sortedNames[i] == name:
+                    res.append(name)
+                    break
         return res
 
 
+    def _readSourcesSections(self, entries):
+        '''
+            Yields (name, section) for each SourcesIndex entry in entries, where section is a
+            StanzaView of the entry in the corresponding (memory mapped) Sources file. Field
+            values of a section are only decoded if they are requested.
+        '''
+        listsDir = self.rootdir + "/var/lib/apt/lists/"
+        curFile = None
+        tagfile = None
+        for (name, sourcesFile, unused_component, offset, *unused) in entries:
+            if sourcesFile != curFile:
+                logger.debug("reading sources file {}".format(sourcesFile))
+                tagfile = MappedTagFile(listsDir + sourcesFile)
+                curFile = sourcesFile
+            yield (name, tagfile.getSection(offset))
+
+
     def getSourcesFiles(self):
         '''
             If this RepoSuite is configured to support Sources (Key "DebSrc" in suites-file is True)
@@ -470,31 +876,37 @@ class RepoSuite:
         return res
             
 
-    class __Progress(apt.progress.base.AcquireProgress):
+    @staticmethod
+    def __newProgress():
         '''
-            Logging of network activity for RepoSuite.updateCache()
+            Returns a new AcquireProgress for logging the network activity of update().
+            The (expensive) apt module is imported on first use only.
         '''
-    
-        logger = logging.getLogger(__name__)
-    
-        def start(self):
-            self.logger.debug("[start]")
-    
-        def stop(self):
-            self.logger.debug("[stop]")
-    
-        def fetch(self, i):
-            self.logger.debug("[fetch {}]".format(i.description))
-    
-        def fail(self, i):
-            self.logger.debug("[fail {}]".format(i.description))
-    
-        def done(self, i):
-            self.logger.debug("[done {}]".format(i.description))
-    
-        def ims_hit(self, i):
-            self.logger.debug("[hit {}]".format(i.description))
-    
+        apt_repos._initAptPkg()
+        import apt.progress.base
+
+        class Progress(apt.progress.base.AcquireProgress):
+
+            def start(self):
+                logger.debug("[start]")
+
+            def stop(self):
+                logger.debug("[stop]")
+
+            def fetch(self, i):
+                logger.debug("[fetch {}]".format(i.description))
+
+            def fail(self, i):
+                logger.debug("[fail {}]".format(i.description))
+
+            def done(self, i):
+                logger.debug("[done {}]".format(i.description))
+
+            def ims_hit(self, i):
+                logger.debug("[hit {}]".format(i.description))
+
+        return Progress()
+
     @staticmethod
     def __sources():
         '''
@@ -27,11 +27,10 @@ import logging
 import re
 import json
 
-import apt_pkg
-import apt.progress
 import functools
 
 from apt_repos.RepositoryScanner import scanRepository
+from apt_repos.RepoSuite import RepoSuite
 from urllib.parse import urlparse, urljoin
 
 logger = logging.getLogger(__name__)
@@ -56,6 +55,7 @@ class Repository:
         self.commonUrl = repoDesc['Url'] + ("/" if not repoDesc['Url'].endswith("/") else "")
         self.commonCodename = repoDesc.get('Codename')
         self.scan = repoDesc.get('Scan')
+        self.scanDepth = repoDesc.get('ScanDepth')
         self.extractSuiteFromReleaseUrl = repoDesc.get('ExtractSuiteFromReleaseUrl')
         self.suites = repoDesc.get("Suites", list())
         # convert self.suite string entries into dicts
@@ -70,6 +70,7 @@ class Repository:
         self.trustedGPGFile = repoDesc.get('TrustedGPG')
         self.debSrc = repoDesc.get('DebSrc')
         self.trusted = repoDesc.get('Trusted')
+        self.maxAge = repoDesc.get('MaxAge')
 
 
     def querySuiteDescs(self, selRepo, selSuite):
@@ -102,21 +103,35 @@ class Repository:
                 if len(found) > 0:
                     logger.debug("Using self contained suite definition '{}' from the .repos file (no scan required)".format(ownSuite))
                 else:
-                    found = scanRepository(url, [self.__getCodename(suiteDict)])
+                    found = scanRepository(url, [self.__getCodename(suiteDict)],
+                                           self.__getScanMaxAge(suiteDict.get('MaxAge', self.maxAge)))
                 res.extend(self.__getSuiteDescs(self.prefix, found, suiteDict))
         
         if self.scan and self.__isRepositorySelected(selRepo):
             logger.info("Scanning {}".format(self))
             if len(suite) > 0:
-                found = scanRepository(self.__getUrl(), [suite])
+                found = scanRepository(self.__getUrl(), [suite], self.__getScanMaxAge(self.maxAge))
                 res.extend(self.__getSuiteDescs(self.prefix, found))
             else:
-                found = scanRepository(self.__getUrl())
+                found = scanRepository(self.__getUrl(), maxAge=self.__getScanMaxAge(self.maxAge), maxDepth=self.scanDepth)
                 res.extend(self.__getSuiteDescs(self.prefix, found))
                 
         return res
 
 
+    def __getScanMaxAge(self, maxAge):
+        '''
+            Returns the MaxAge setting maxAge in seconds or None. Cached scan results that were
+            checked less than MaxAge ago are used without contacting the repository server
+            (just like the lists of suites that were updated less than MaxAge ago).
+        '''
+        try:
+            return RepoSuite.parseMaxAge(maxAge)
+        except ValueError:
+            # invalid values are reported by the RepoSuite
+            return None
+
+
     def __isRepositorySelected(self, selRepo, suiteDict=dict()):
         '''
             Returns true if the repository is selected by the repository selector
@@ -175,7 +190,7 @@ class Repository:
                 option = '[trusted=yes] ' if self.__getTrustedFlag(suiteDict) else ''
                 debSrc = suite['hasSources'] if self.debSrc == None else self.debSrc
                 tags = sorted(self.__getTags(suiteDict))
-                res.append({
+                suiteDesc = {
                     "Suite" : prefix + suitename,
                     "Description" : self.desc,
                     "Tags" : tags,
@@ -183,7 +198,11 @@ class Repository:
                     "DebSrc" : debSrc,
                     "Architectures" : archs,
                     "TrustedGPG" : self.trustedGPGFile
-                })
+                }
+                maxAge = suiteDict.get('MaxAge', self.maxAge)
+                if maxAge != None:
+                    suiteDesc["MaxAge"] = maxAge
+                res.append(suiteDesc)
             except Exception as e:
                 logger.warn("Could not get Suite-Description for suite {}: {}".format(suite, e))
         return res
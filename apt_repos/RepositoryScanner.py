@@ -30,108 +30,210 @@ import codecs
 import re
 import subprocess
 import os
-import apt_pkg
-import tempfile
+import json
+import time
+import threading
 from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
-from urllib3.exceptions import MaxRetryError
+from urllib3.exceptions import HTTPError
 
 logger = logging.getLogger(__name__)
 
+# the ScanCache used by getCachedResult(...), see setScanCacheFile(...)
+__scanCache = None
 
-def scanRepository(url, suites=None):
+# the Release fields and regular expressions used by parseReleaseFile(...)
+__releaseFields = ['suite', 'codename', 'components', 'architectures']
+__emptyLine = re.compile(rb"\r?\n[ \t]*\r?\n")
+__nextField = re.compile(rb"\n(?=[^ \t])")
+__sourcesIndex = re.compile(rb"[ \t]+\S+[ \t]+\d+[ \t]+\S+/source/Sources(\.xz|\.gz)?\r?$")
+
+# default number of concurrent requests during a repository scan
+SCAN_JOBS = 8
+
+# the shared http connection pool and it's options, see setHttpOptions(...)
+__httpPool = None
+__httpPoolLock = threading.Lock()
+__httpTimeout = urllib3.Timeout(connect=10.0, read=30.0)
+__httpRetries = urllib3.Retry(total=3, connect=1, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+__httpMaxPerHost = 4
+
+
+def scanRepository(url, suites=None, maxAge=None, maxDepth=None, jobs=SCAN_JOBS):
+    '''
+       returns the suites found in the repository at url. If suites is given, only the
+       Release files of these suites are read, otherwise the repository is scanned
+       recursively for suites (see scanReleases(...) for maxDepth). Up to jobs urls
+       are requested concurrently, but the order of the results is deterministic.
+       Results of http(s) urls are cached in the scan cache (see setScanCacheFile(...)).
+       Cached results that were checked less than maxAge seconds ago are used without
+       contacting the server.
+    '''
     logger.debug("scanRepository('{}', {})".format(url, suites))
     url = url + ("/" if not url.endswith("/") else "")
     res = list()
     if suites:
-        for s in suites:
+        def scanSuite(s):
             try:
-                res.append(scanReleaseFile(urljoin(url, os.path.join('dists', s, 'Release')), url))
+                return (True, scanReleaseFile(urljoin(url, os.path.join('dists', s, 'Release')), url, maxAge))
             except Exception:
                 logger.warn("Could not resolve suite {} of repository {}".format(s, url))
+                return (False, None)
+        with ThreadPoolExecutor(max(1, min(jobs, len(suites)))) as executor:
+            for ok, suite in executor.map(scanSuite, suites):
+                if ok:
+                    res.append(suite)
     else:
         try:
-            res.extend(scanReleases(urljoin(url, "dists/"), url))
+            res.extend(scanReleases(urljoin(url, "dists/"), url, maxAge=maxAge, maxDepth=maxDepth, jobs=jobs))
         except Exception as e:
             logger.warn("Could not resolve repository {}".format(url))
+    if __scanCache:
+        __scanCache.save()
     return res
 
 
-def scanReleases(url, repoUrl, recursive=True):
+def scanReleases(url, repoUrl, recursive=True, maxAge=None, maxDepth=None, jobs=SCAN_JOBS):
     '''
-       return suites found at url and all it's relevant subfolders if recursive==True
+       return suites found at url and all it's relevant subfolders if recursive==True.
+       maxDepth optionally limits the number of subfolder levels below url that are scanned.
+
+       The folders are scanned level by level: the index pages (and Release files) of all
+       folders of a level are requested concurrently by up to jobs threads, so the scan
+       requires about one round trip per folder level. The suites are returned in the
+       same order as a sequential, depth first scan of the sorted subfolders would return.
     '''
     logger.debug("scanReleases('{}', {})".format(url, recursive))
-    suites = list()
+    if not recursive:
+        maxDepth = 0
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        return __scanLevel(executor, [url], repoUrl, maxAge, 0, maxDepth)[0]
+
+
+def __scanLevel(executor, urls, repoUrl, maxAge, depth, maxDepth):
+    '''
+       scans the folders urls (of the same depth) concurrently and returns a list
+       containing the list of suites found in each folder and it's subfolders.
+    '''
+    scan = lambda url: __scanFolder(url, repoUrl, maxAge, maxDepth == None or depth < maxDepth)
+    folders = list(executor.map(scan, urls))
+    suburls = [suburl for (unused_suite, subs) in folders for suburl in subs]
+    subResults = iter(__scanLevel(executor, suburls, repoUrl, maxAge, depth + 1, maxDepth) if suburls else [])
+    res = list()
+    for (suite, subs) in folders:
+        suites = [suite] if suite else list()
+        for unused_suburl in subs:
+            suites.extend(next(subResults))
+        res.append(suites)
+    return res
+
+
+def __scanFolder(url, repoUrl, maxAge, withSubfolders):
+    '''
+       returns a tuple (suite, suburls) for the folder url, where suite is the suite
+       described by the folder's Release file (or None) and suburls is the sorted list
+       of the relevant subfolder urls (if withSubfolders is True).
+    '''
+    logger.debug("scanFolder('{}')".format(url))
     ignoreFolders = list(['by-hash'])
 
     p = urlparse(url)
     if p.scheme == "file":
-        index = LocalFilesystemScanner(url)
+        index = LocalFilesystemScanner(url).getIndex()
     else:
-        index = HtmlIndexParser(url)
+        index = getCachedResult(url, lambda data: HtmlIndexParser(url, data).getIndex(), maxAge)
 
-    if index.release:
-        suite = scanReleaseFile(index.release, repoUrl)
+    # prefer the InRelease file (which is available in most current repositories)
+    releaseUrl = index['inRelease'] or index['release']
+    suite = None
+    if releaseUrl:
+        suite = scanReleaseFile(releaseUrl, repoUrl, maxAge)
         if suite:
-          suites.append(suite)
           ignoreFolders.extend(suite['components'])
 
-    if recursive:
-        for subfolder, suburl in sorted(index.getSubfolders().items()):
+    suburls = list()
+    if withSubfolders:
+        for subfolder, suburl in sorted(index['subfolders'].items()):
             if not subfolder in ignoreFolders:
-                suites.extend(scanReleases(suburl, repoUrl))
+                suburls.append(suburl)
+    return (suite, suburls)
 
-    return suites
 
-
-def scanReleaseFile(url, repoUrl):
+def scanReleaseFile(url, repoUrl, maxAge=None):
     logger.debug("scanReleaseFile('{}')".format(url))
-    data = getFromURL(url)
-    with tempfile.TemporaryFile() as fp:
-        fp.write(data)
-        fp.seek(0)
-        with apt_pkg.TagFile(fp) as tagfile:
-            try:
-                for section in tagfile:
-                    if not section.get('Suite'):
-                        continue
-                    components = section.get('Components').split(" ") if section.get('Components') else list()
-                    architectures = section.get('Architectures').split(" ") if section.get('Architectures') else list()
-                    md5sum = section.get('MD5Sum').split("\n") if section.get('Md5Sum') else list()
-                    files=[re.sub(" +", " ", s.strip()).split(" ")[2] for s in md5sum]
-                    hasSources=suiteHasSources(files)
-                    return { 
-                        'repoUrl': repoUrl,
-                        'releaseUrl': url,
-                        'suite': section.get('Suite'),
-                        'codename': section.get('Codename'),
-                        'components': components,
-                        'architectures': architectures,
-                        'hasSources': hasSources
-                        #'files':files
-                    }
-            except SystemError:
-                raise Exception("invalid release file or no suite found at {}".format(url))
-
-
-def suiteHasSources(files):
-    for f in files:
-        if ( f.endswith('/source/Sources') or 
-             f.endswith('/source/Sources.xz') or
-             f.endswith('/source/Sources.gz')):
-            return True
-    return False
+    suite = getCachedResult(url, lambda data: parseReleaseFile(url, data), maxAge)
+    if suite:
+        suite = dict(suite)
+        suite['repoUrl'] = repoUrl
+    return suite
+
+
+def parseReleaseFile(url, data):
+    '''
+       returns the suite description found in the Release (or InRelease) file data (read
+       from url) or None if the file doesn't describe a suite.
+
+       The file is parsed in memory and only up to the end of it's first paragraph. Of the
+       (possibly very long) checksum lists only the first one containing a Sources index
+       is searched. The PGP signature of an InRelease file is skipped, but not verified
+       (this is done by apt when the suite's lists are updated).
+    '''
+    (pos, end) = (0, len(data))
+    if data.startswith(b"-----BEGIN PGP SIGNED MESSAGE-----"):
+        # the signed text starts after the armor headers and ends before the signature
+        m = __emptyLine.search(data)
+        pos = m.end() if m else end
+        signature = data.find(b"\n-----BEGIN PGP SIGNATURE-----", pos)
+        end = signature + 1 if signature >= 0 else end
+
+    fields = dict()
+    hasSources = False
+    while pos < end:
+        lineEnd = data.find(b"\n", pos, end)
+        lineEnd = end if lineEnd < 0 else lineEnd
+        line = data[pos:lineEnd].rstrip()
+        if len(line) == 0:
+            break
+        (key, unused_sep, value) = line.partition(b":")
+        value = value.strip()
+        if len(value) > 0:
+            fields[key.decode('utf-8', 'replace').lower()] = value.decode('utf-8', 'replace')
+            pos = lineEnd + 1
+            continue
+        # a multiline field (e.g. a checksum list) ends before the next line not starting with a space
+        m = __nextField.search(data, lineEnd, end)
+        listEnd = m.start() + 1 if m else end
+        candidate = data.find(b"/source/Sources", lineEnd, listEnd) if not hasSources else -1
+        while candidate >= 0 and not hasSources:
+            candidateEnd = data.find(b"\n", candidate, listEnd)
+            candidateEnd = listEnd if candidateEnd < 0 else candidateEnd
+            hasSources = __sourcesIndex.match(data, data.rfind(b"\n", lineEnd, candidate) + 1, candidateEnd) != None
+            candidate = data.find(b"/source/Sources", candidateEnd, listEnd)
+        if hasSources and all(f in fields for f in __releaseFields):
+            break
+        pos = listEnd
+
+    if not fields.get('suite'):
+        return None
+    return { 
+        'releaseUrl': url,
+        'suite': fields.get('suite'),
+        'codename': fields.get('codename'),
+        'components': fields.get('components').split(" ") if fields.get('components') else list(),
+        'architectures': fields.get('architectures').split(" ") if fields.get('architectures') else list(),
+        'hasSources': hasSources
+    }
 
 
 class HtmlIndexParser(HTMLParser):
-    def __init__(self, baseurl):
+    def __init__(self, baseurl, data=None):
         HTMLParser.__init__(self)
         self.baseurl = urljoin(baseurl, "./")
         self.release = None
         self.inRelease = None
         self.subfolders = dict()
-        self.feed(getHttp(self.baseurl).decode('utf8'))
+        self.feed((data if data != None else getHttp(self.baseurl)).decode('utf8'))
         
     def handle_starttag(self, tag, attrs):
         if tag.upper() == 'A':
@@ -153,6 +255,9 @@ class HtmlIndexParser(HTMLParser):
     def getSubfolders(self):
         return self.subfolders
 
+    def getIndex(self):
+        return { 'release': self.release, 'inRelease': self.inRelease, 'subfolders': self.subfolders }
+
 
 class LocalFilesystemScanner():
     def __init__(self, baseurl):
@@ -175,10 +280,13 @@ class LocalFilesystemScanner():
     def getSubfolders(self):
         return self.subfolders
 
+    def getIndex(self):
+        return { 'release': self.release, 'inRelease': self.inRelease, 'subfolders': self.subfolders }
+
 
 def getFromURL(url):
     '''
-        encapsulates url access for http:// and file:// urls
+        encapsulates url access for http://, https:// and file:// urls
     '''
     p = urlparse(url)
     if p.scheme == "file":
@@ -186,16 +294,169 @@ def getFromURL(url):
         with open(p.path.replace("%20", " "), "rb") as input:
             data = input.read()
         return data
-    if p.scheme == "http":
+    if p.scheme in ["http", "https"]:
         return getHttp(url)
 
 
 def getHttp(url):
-    http = urllib3.PoolManager()
+    (status, data, unused_headers) = requestHttp(url)
+    if status != 200:
+        raise Exception("http-request to url {} failed with status code {}".format(url, status))
+    return data
+
+
+def requestHttp(url, headers=None):
+    '''
+        sends a GET request for url (with the optional request headers) using the
+        shared connection pool (see getHttpPool()) and returns a tuple
+        (status, data, responseHeaders).
+    '''
     try:
-        req = http.request('GET', url)
-        if req.status != 200:
-            raise Exception("http-request to url {} failed with status code {}".format(url, req.status))
-        return req.data
-    except MaxRetryError as e:
+        req = getHttpPool().request('GET', url, headers=headers)
+        return (req.status, req.data, req.headers)
+    except HTTPError as e:
         raise Exception("http-request to url {} failed".format(url), e)
+
+
+def setHttpOptions(timeout=None, retries=None, maxPerHost=None):
+    '''
+        Changes the options of the shared connection pool used for all http(s) requests:
+
+        timeout: urllib3.Timeout (or number of seconds) for connecting to and reading from a server.
+
+        retries: urllib3.Retry (or number of retries) describing how failed requests are repeated.
+
+        maxPerHost: maximum number of concurrent connections to a single host. Further requests
+                    to this host wait for a free connection.
+
+        Options that are None keep their current value.
+    '''
+    global __httpTimeout, __httpRetries, __httpMaxPerHost, __httpPool
+    with __httpPoolLock:
+        __httpTimeout = timeout if timeout != None else __httpTimeout
+        __httpRetries = retries if retries != None else __httpRetries
+        __httpMaxPerHost = maxPerHost if maxPerHost != None else __httpMaxPerHost
+        __httpPool = None
+
+
+def getHttpPool():
+    '''
+        Returns the urllib3.PoolManager that is shared by all http(s) requests of the scanner,
+        so connections to a server are kept alive and reused between the many requests of a scan.
+    '''
+    global __httpPool
+    with __httpPoolLock:
+        if __httpPool == None:
+            __httpPool = urllib3.PoolManager(maxsize=__httpMaxPerHost, block=True,
+                                             timeout=__httpTimeout, retries=__httpRetries)
+        return __httpPool
+
+
+def setScanCacheFile(filename):
+    '''
+        Use the json file filename to persist the results of scanned http(s) urls
+        (see getCachedResult(...)). If filename is None, results are not cached.
+    '''
+    global __scanCache
+    __scanCache = ScanCache(filename) if filename else None
+
+
+def getCachedResult(url, parse, maxAge=None):
+    '''
+        returns parse(data) for the content data of url. For http(s) urls, the (json
+        compatible) result is stored in the scan cache together with the ETag and
+        Last-Modified headers of the response. A cached result is used
+        - without request if it was checked less than maxAge seconds ago,
+        - if a conditional request reports that the content is not modified,
+        - if the url can't be requested at all (offline mode).
+    '''
+    if not __scanCache or not urlparse(url).scheme in ["http", "https"]:
+        return parse(getFromURL(url))
+    entry = __scanCache.get(url)
+    if entry and maxAge != None and time.time() - entry['Checked'] < maxAge:
+        logger.debug("using cached result for {}".format(url))
+        return entry['Result']
+    headers = dict()
+    if entry and entry.get('ETag'):
+        headers['If-None-Match'] = entry['ETag']
+    if entry and entry.get('Last-Modified'):
+        headers['If-Modified-Since'] = entry['Last-Modified']
+    try:
+        (status, data, responseHeaders) = requestHttp(url, headers)
+    except Exception as e:
+        if not entry:
+            raise
+        logger.warning("Using cached result for unreachable url {}".format(url))
+        return entry['Result']
+    if status == 304 and entry:
+        logger.debug("cached result for {} is not modified".format(url))
+        __scanCache.put(url, entry.get('ETag'), entry.get('Last-Modified'), entry['Result'])
+        return entry['Result']
+    if status != 200:
+        raise Exception("http-request to url {} failed with status code {}".format(url, status))
+    result = parse(data)
+    __scanCache.put(url, responseHeaders.get('ETag'), responseHeaders.get('Last-Modified'), result)
+    return result
+
+
+class ScanCache:
+    '''
+        A ScanCache persists the (json compatible) results of scanned urls together with
+        the validators (ETag, Last-Modified) of the corresponding http responses and the
+        time of the last check. The json file is read on first access and written by save()
+        if it was changed.
+    '''
+
+    FORMAT = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = None
+        self.changed = False
+        # a ScanCache is shared by the threads of a concurrent scan
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            if self.entries == None:
+                self.entries = self.__load()
+            return self.entries.get(url)
+
+    def put(self, url, etag, lastModified, result):
+        with self.lock:
+            if self.entries == None:
+                self.entries = self.__load()
+            self.entries[url] = {
+                'ETag': etag,
+                'Last-Modified': lastModified,
+                'Checked': time.time(),
+                'Result': result
+            }
+            self.changed = True
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            tmpFile = "{}.{}.tmp".format(self.filename, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+                with open(tmpFile, 'w') as fh:
+                    json.dump({ 'Format': ScanCache.FORMAT, 'Entries': self.entries }, fh, separators=(',', ':'))
+                os.replace(tmpFile, self.filename)
+                self.changed = False
+            except OSError as e:
+                logger.warning("Could not write scan cache {}: {}".format(self.filename, e))
+
+    def __load(self):
+        try:
+            with open(self.filename, 'r') as fh:
+                data = json.load(fh)
+            if data.get('Format') == ScanCache.FORMAT:
+                return data['Entries']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.debug("Ignoring unreadable scan cache {}: {}".format(self.filename, e))
+        return dict()
+
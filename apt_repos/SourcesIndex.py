@@ -0,0 +1,227 @@
+#!/usr/bin/python3 -Es
+# -*- coding: utf-8 -*-
+##################################################################################
+# Access information about binary and source packages in multiple
+# (independent) apt-repositories utilizing libapt / python-apt/
+# apt_pkg without the need to change the local system and it's apt-setup.
+#
+# Copyright (C) 2017  Christoph Lutz
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+##################################################################################
+import os
+import re
+import logging
+import json
+import apt_pkg
+
+logger = logging.getLogger(__name__)
+
+
+class SourcesIndex:
+    '''
+        A SourcesIndex maps source package names to the positions of their sections in
+        the *_Sources files of a suite together with the data required for the most common
+        queries (version, component, Directory and the name of the .dsc file). It allows us
+        to answer queries for exact source names (or name prefixes) without parsing all
+        Sources files with apt_pkg.TagFile on each call.
+
+        Like the PackagesIndex, a SourcesIndex is bound to a fingerprint of the apt lists
+        it was built from and is persisted in a json file. In addition, the sorted names
+        of the source packages per component can be persisted in a separate (much smaller)
+        json file, which allows to check if a suite contains a source package without
+        loading the whole index (see getNamesByComponent(), saveNames(...) and loadNames(...)).
+    '''
+
+    FORMAT = 1
+    NAMES_FORMAT = 1
+
+    def __init__(self, fingerprint, files, sources):
+        '''
+            Creates a new SourcesIndex:
+
+            fingerprint: A json compatible value describing the state of the apt lists
+                         this index was built from.
+
+            files: list of [sourcesFile, component] pairs, where sourcesFile is the basename
+                   of a *_Sources file and component the component derived from the filename
+                   (or None if the component could not be derived).
+
+            sources: dict that maps a source package name to a list of entries
+                     [fileIndex, offset, version, directory, dscFile] describing the
+                     sections of this source in the order they appear in the files.
+        '''
+        self.fingerprint = fingerprint
+        self.files = files
+        self.sources = sources
+        self.sortedNames = None
+
+
+    @staticmethod
+    def build(sourcesFiles, fingerprint):
+        '''
+            This factory-method creates a new SourcesIndex by parsing the list of
+            *_Sources files sourcesFiles (full paths) once.
+        '''
+        logger.debug("building sources index")
+        files = list()
+        sources = dict()
+        for fileIndex, sourcesFile in enumerate(sourcesFiles):
+            m = re.search("^.*_([^_]+)_source_Sources$", sourcesFile)
+            files.append([os.path.basename(sourcesFile), m.group(1) if m else None])
+            with open(sourcesFile, 'r') as f:
+                with apt_pkg.TagFile(f) as tagfile:
+                    while True:
+                        offset = tagfile.offset()
+                        if not tagfile.step():
+                            break
+                        section = tagfile.section
+                        sources.setdefault(section['Package'], list()).append([fileIndex, offset,
+                            section.get('Version'), section.get('Directory'), SourcesIndex.getDscFile(section)])
+        return SourcesIndex(fingerprint, files, sources)
+
+
+    @staticmethod
+    def getDscFile(section):
+        '''
+            Returns the name of the .dsc file listed in the Files-field of the Sources
+            section section or None if there is no .dsc file.
+        '''
+        for f in section.get('Files', '').split("\n"):
+            parts = f.strip().split(" ")
+            if len(parts) == 3 and parts[2].endswith(".dsc"):
+                return parts[2]
+        return None
+
+
+    @staticmethod
+    def load(filename, fingerprint):
+        '''
+            This factory-method reads a SourcesIndex from the json file filename.
+            It returns None if the file doesn't exist, is unreadable or if the stored
+            index was built for another fingerprint.
+        '''
+        try:
+            with open(filename, 'r') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.debug("Ignoring unreadable sources index {}: {}".format(filename, e))
+            return None
+        if data.get('Format') != SourcesIndex.FORMAT or data.get('Fingerprint') != fingerprint:
+            logger.debug("sources index {} is outdated".format(filename))
+            return None
+        return SourcesIndex(fingerprint, data['Files'], data['Sources'])
+
+
+    def save(self, filename):
+        '''
+            Writes this SourcesIndex to the json file filename. The file is replaced
+            atomically, so concurrent readers either see the old or the new index.
+        '''
+        data = {
+            'Format': SourcesIndex.FORMAT,
+            'Fingerprint': self.fingerprint,
+            'Files': self.files,
+            'Sources': self.sources
+        }
+        tmpFile = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(tmpFile, 'w') as fh:
+                json.dump(data, fh, separators=(',', ':'))
+            os.replace(tmpFile, filename)
+        except OSError as e:
+            logger.warning("Could not write sources index {}: {}".format(filename, e))
+
+
+    def getSortedNames(self):
+        '''
+            Returns the sorted list of all source package names known by this index.
+        '''
+        if self.sortedNames == None:
+            self.sortedNames = sorted(self.sources.keys())
+        return self.sortedNames
+
+
+    def getEntries(self, names):
+        '''
+            Returns the list of index entries of the source packages with the names names
+            in the order they appear in the Sources files. Each entry is a tuple
+            (name, sourcesFile, component, offset, version, directory, dscFile) where
+            sourcesFile is the basename of the *_Sources file containing the section.
+        '''
+        entries = list()
+        for name in set(names):
+            for (fileIndex, offset, version, directory, dscFile) in self.sources.get(name, []):
+                entries.append((fileIndex, offset, name, version, directory, dscFile))
+        res = list()
+        for (fileIndex, offset, name, version, directory, dscFile) in sorted(entries):
+            sourcesFile, component = self.files[fileIndex]
+            res.append((name, sourcesFile, component, offset, version, directory, dscFile))
+        return res
+
+
+    def getNamesByComponent(self):
+        '''
+            Returns a dict that maps each component (None for Sources files without a
+            derivable component) to the sorted list of the source package names in it.
+        '''
+        names = dict()
+        for name, entries in self.sources.items():
+            for (fileIndex, *unused) in entries:
+                names.setdefault(self.files[fileIndex][1], set()).add(name)
+        return { component : sorted(n) for component, n in names.items() }
+
+
+    def saveNames(self, filename):
+        '''
+            Writes the result of getNamesByComponent() to the json file filename.
+        '''
+        data = {
+            'Format': SourcesIndex.NAMES_FORMAT,
+            'Fingerprint': self.fingerprint,
+            'Components': [[component, names] for component, names in self.getNamesByComponent().items()]
+        }
+        tmpFile = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(tmpFile, 'w') as fh:
+                json.dump(data, fh, separators=(',', ':'))
+            os.replace(tmpFile, filename)
+        except OSError as e:
+            logger.warning("Could not write source names {}: {}".format(filename, e))
+
+
+    @staticmethod
+    def loadNames(filename, fingerprint):
+        '''
+            Reads the names by component written by saveNames(...) from the json file filename.
+            It returns None if the file doesn't exist, is unreadable or if the stored
+            names were written for another fingerprint.
+        '''
+        try:
+            with open(filename, 'r') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.debug("Ignoring unreadable source names {}: {}".format(filename, e))
+            return None
+        if data.get('Format') != SourcesIndex.NAMES_FORMAT or data.get('Fingerprint') != fingerprint:
+            logger.debug("source names {} are outdated".format(filename))
+            return None
+        return { component : names for (component, names) in data['Components'] }
@@ -33,10 +33,10 @@
 
 import os
 import sys
-import argparse
 import logging
-import re
-import json
+import importlib
+import functools
+import time
 from os.path import expanduser
 
 logger = logging.getLogger(__name__)
@@ -44,24 +44,68 @@ logger = logging.getLogger(__name__)
 __defaultBaseDirs = [ expanduser('~') + '/.config/apt-repos', expanduser('~') + '/.apt-repos', '/etc/apt-repos' ]
 __defaultCacheDir = expanduser('~') + '/.cache/apt-repos'
 __aptConf = __defaultCacheDir + "/apt.conf"
-if not os.path.isdir(__defaultCacheDir):
-    os.makedirs(__defaultCacheDir, exist_ok=True)
-    with open(__aptConf, "w") as fh:
-        print('Dir "{}";'.format(__defaultCacheDir), file=fh)
+# APT_CONFIG needs to be set before apt_pkg is initialized (see _initAptPkg())
 os.environ["APT_CONFIG"] = __aptConf
+__aptPkgInitialized = False
 __baseDirs = __defaultBaseDirs
 __cacheDir = __defaultCacheDir
+__scanCacheFile = None
+__compiledConfig = None
 
-import apt_pkg
-import apt.progress
-import functools
+from apt_repos.PackageField import PackageField
+from apt_repos.CompiledConfig import CompiledConfig
 
-from enum import Enum
+# classes that are imported on first access only (see __getattr__)
+__lazyClasses = [ 'RepoSuite', 'QueryResult', 'Repository' ]
 
-from apt_repos.RepoSuite import RepoSuite
-from apt_repos.PackageField import PackageField
-from apt_repos.QueryResult import QueryResult
-from apt_repos.Repository import Repository
+
+def __getattr__(name):
+    '''
+       Imports the classes RepoSuite, QueryResult and Repository on first access (see PEP 562),
+       so that importing apt_repos doesn't load apt_pkg, urllib3, ... before they are needed.
+    '''
+    if not name in __lazyClasses:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+    importlib.import_module("apt_repos." + name)
+    # importing a submodule binds the module object to the package attribute with
+    # the same name, so we bind the classes of all loaded submodules (again).
+    for className in __lazyClasses:
+        module = sys.modules.get("apt_repos." + className)
+        if module:
+            globals()[className] = getattr(module, className)
+    __setupRepositoryScanner()
+    return globals()[name]
+
+
+def _initAptPkg():
+    '''
+       Initializes apt_pkg once per process. The apt.conf referenced by APT_CONFIG is
+       created in the default cache directory if it doesn't exist yet, so that apt_pkg
+       doesn't read the apt configuration of the local system.
+    '''
+    global __aptPkgInitialized
+    if __aptPkgInitialized:
+        return
+    if not os.path.isfile(__aptConf):
+        os.makedirs(__defaultCacheDir, exist_ok=True)
+        with open(__aptConf, "w") as fh:
+            print('Dir "{}";'.format(__defaultCacheDir), file=fh)
+    import apt_pkg
+    apt_pkg.init_config()
+    apt_pkg.init_system()
+    __aptPkgInitialized = True
+
+
+def __setupRepositoryScanner():
+    '''
+       Lets the RepositoryScanner (if it is already loaded) persist it's scan results
+       in the current cache directory.
+    '''
+    global __scanCacheFile
+    scanner = sys.modules.get("apt_repos.RepositoryScanner")
+    if scanner and __scanCacheFile != __cacheDir + "/scan.cache":
+        __scanCacheFile = __cacheDir + "/scan.cache"
+        scanner.setScanCacheFile(__scanCacheFile)
 
 
 import contextlib
@@ -105,6 +149,9 @@ def suppress_unwanted_apt_pkg_messages():
         to pass data back from the fork to the main process. This means the fork (your code block)
         should be a delimited and terminated task that requires no further interaction with the
         main process.
+
+        Note: RepoSuite silences the native apt_pkg calls using silenced_stdout_channel(),
+        so this (forking) context manager isn't required anymore when using RepoSuites.
     '''
     pipein, pipeout = os.pipe()
     pid = os.fork()
@@ -117,7 +164,7 @@ def suppress_unwanted_apt_pkg_messages():
     else:
         os.close(pipeout)
         pipeinFile = os.fdopen(pipein, "r")
-        for line in pipeinFile.readlines():
+        for line in pipeinFile:
             print(line, end='')
         (unused_cpid, ret) = os.wait()
         ret = (ret & 0xff00) >> 8
@@ -126,6 +173,37 @@ def suppress_unwanted_apt_pkg_messages():
         yield False
 
 
+@contextlib.contextmanager
+def silenced_stdout_channel():
+    '''
+        This contextmanager lets stdout (channel 1) point to /dev/null while the code block
+        is executed, without forking the process. It is meant to wrap calls of native apt_pkg
+        code that writes unwanted messages directly to channel 1 (see
+        suppress_unwanted_apt_pkg_messages()), e.g. in the following way:
+
+        with apt_repos.silenced_stdout_channel():
+            cache = apt_pkg.Cache()
+
+        Output of the python code in the block that is written to sys.stdout is lost,
+        too, so the block should be as small as possible. If channel 1 is closed, the
+        block is executed unchanged.
+    '''
+    sys.stdout.flush()
+    try:
+        savedStdout = os.dup(1)
+    except OSError:
+        yield
+        return
+    try:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.close(devnull)
+        yield
+    finally:
+        os.dup2(savedStdout, 1)
+        os.close(savedStdout)
+
+
 def setAptReposBaseDir(dir):
     '''
        Use the specified dir as a sole directory for reading *.suites and *.repos
@@ -146,40 +224,24 @@ def setAptReposBaseDir(dir):
           __cacheDir = realDir + '/.apt-repos_cache'
     else:
         raise Exception("base-directory doesn't exist: " + dir)
-    if not os.path.isdir(__cacheDir):
-        os.makedirs(__cacheDir, exist_ok=True)
-
-
-def __filenameWithoutPrefix(item):
-    (filename, value) = item
-    return re.sub(r"\.\w+$", "", filename)
+    __setupRepositoryScanner()
 
 
-def __prepareConfig(collectedConfigs):
+def __getCompiledConfig():
     '''
-        Handles overrides and returns a list of config items in the defined order.
-        `collectedConfigs` is expexted to be a map filename -> (jsonData, basedir)
+        Returns the CompiledConfig for the current base directories. The config is compiled
+        only once per process and persisted in the cache directory, so it is only recompiled
+        if one of the *.suites- or *.repos-files was changed.
     '''
-    res = list()
-    mapOidToConf = dict()
-    for filename, (descs, basedir) in sorted(collectedConfigs.items(), key=__filenameWithoutPrefix):
-        logger.debug("preparing config from file {}/{}".format(basedir, filename))
-        for conf in descs:
-            if not type(conf) is dict:
-                continue
-            oid = conf.get("Oid", None)
-            if oid:
-                toOverride = mapOidToConf.get(oid)
-                if not toOverride:
-                    mapOidToConf[oid] = conf
-                    logger.debug("new override '{}'".format(oid))
-                else:
-                    for k, v in conf.items():
-                        toOverride[k] = v
-                        logger.debug("added to override '{}': {} --> {}".format(oid, k, v))
-                    continue
-            res.append((conf, basedir, filename))
-    return res
+    global __compiledConfig
+    signature = CompiledConfig.getSignature(__baseDirs)
+    if __compiledConfig == None or __compiledConfig.signature != signature:
+        cacheFile = __cacheDir + "/config.cache"
+        __compiledConfig = CompiledConfig.load(cacheFile, signature)
+        if not __compiledConfig:
+            __compiledConfig = CompiledConfig.build(__baseDirs, signature)
+            __compiledConfig.save(cacheFile)
+    return __compiledConfig
 
 
 def getSuites(selectors=None):
@@ -187,36 +249,10 @@ def getSuites(selectors=None):
        This method returns a set of suites matched by selectors, where
        selectors is an array of selector-Strings.
     '''
-    suitesData = dict() # map of filename --> (jsonData, basedir)
-    reposData = dict() # map of filename --> (jsonData, basedir)
-    configSectionsCount = 0
-    for basedir in __baseDirs:
-        if not os.path.isdir(basedir):
-            if len(suitesData) == 0:
-                logger.debug("Skipping BaseDir {} which doesn't exist".format(basedir))
-            continue
-        for f in sorted(os.listdir(basedir)):
-            if f in suitesData or f in reposData:
-                continue
-            filename = basedir + "/" + f
-            if os.path.isfile(filename):
-                try:
-                    if str(filename).endswith(".suites"):
-                        logger.debug("reading suites file " + filename)
-                        with open(filename, 'r') as file:
-                            jsonData = json.load(file, encoding="utf-8")
-                            suitesData[f] = (jsonData, basedir)
-                            configSectionsCount += len(jsonData)
-                    elif str(filename).endswith(".repos"):
-                        with open(filename, 'r') as file:
-                            jsonData = json.load(file, encoding="utf-8")
-                            reposData[f] = (jsonData, basedir)
-                            configSectionsCount += len(jsonData)
-                except json.decoder.JSONDecodeError as ex:
-                    logger.warning("Skipping unreadable json file {}: {}".format(filename, ex))
-                    
-    if configSectionsCount == 0:
-        logger.warning("No *.suites- or *.repos-files found in the directories '" + "', '".join(__baseDirs) + "'")
+    config = __getCompiledConfig()
+    RepoSuite = __getattr__('RepoSuite')
+    for warning in config.warnings:
+        logger.warning(warning)
         
     if not selectors:
         selectors = ["default:"]
@@ -230,29 +266,20 @@ def getSuites(selectors=None):
         else:
             srepo, ssuiteName = parts
         
-        count = 0
-        for suiteDesc, basedir, unused_filename in __prepareConfig(suitesData):
-            count+=1
-            tags = suiteDesc.get("Tags", [])
-
+        for position in config.selectSuites(srepo, ssuiteName):
+            suiteDesc, basedir, unused_filename = config.suites[position]
             try:
-                parts = suiteDesc["Suite"].split(":", 1)
-                if len(parts) == 1:
-                    repo, suiteName = ("", parts[0])
-                else:
-                    repo, suiteName = parts
-            
-                if (repo == srepo or srepo == "" or srepo in tags) and \
-                    (suiteName == ssuiteName or ssuiteName == ""):
-                    selected.add(RepoSuite(basedir, __cacheDir, suiteDesc, count))
+                selected.add(RepoSuite(basedir, __cacheDir, suiteDesc, position + 1))
             except KeyError as e:
                 logger.warning("Missing key {} --> Skipping suite-entry: {}".format(e, suiteDesc))
                 continue
 
-        for repoDesc, basedir, filename in __prepareConfig(reposData):
+        count = len(config.suites)
+        for position in config.selectRepos(srepo):
+            repoDesc, basedir, filename = config.repos[position]
             repo = None
             try:
-                repo = Repository(repoDesc)
+                repo = __getattr__('Repository')(repoDesc)
             except KeyError as e:
                 logger.warning("Missing key {} --> Skipping repository: {} from file {}".format(e, repoDesc, filename))
                 continue
@@ -261,3 +288,235 @@ def getSuites(selectors=None):
                 selected.add(RepoSuite(basedir, __cacheDir, suiteDesc, count))
                 
     return selected
+
+
+def forEachSuite(function, suites, jobs=1):
+    '''
+       Calls function(suite) for each RepoSuite in the list suites and yields tuples
+       (suite, result) in the order of suites.
+
+       If jobs > 1, the suites are distributed over (at most) jobs worker processes.
+       Each worker process has it's own apt_pkg context, so multiple suites can be
+       scanned and queried in parallel, which is not possible within one process
+       (see RepoSuite). In this case, function, the suites and the results need to
+       be picklable. Please note that the function is executed in the worker processes
+       only, so suites in the calling process are not scanned by this method.
+
+       The calls are started in the order of suites as soon as a worker is available,
+       so later suites are processed speculatively while the results of earlier suites
+       are still awaited. A caller that doesn't need the remaining results can close
+       the generator (e.g. using contextlib.closing): this cancels all pending calls and
+       terminates the worker processes that are still busy with later suites.
+    '''
+    suites = list(suites)
+    if jobs <= 1 or len(suites) <= 1:
+        for suite in suites:
+            yield (suite, function(suite))
+        return
+
+    import multiprocessing
+    __protectStdoutChannel()
+    with multiprocessing.get_context("fork").Pool(min(jobs, len(suites))) as pool:
+        # leaving this block (also by GeneratorExit) terminates the pool
+        for suite, result in zip(suites, pool.imap(function, suites, chunksize=1)):
+            yield (suite, result)
+
+
+def __protectStdoutChannel():
+    '''
+       If stdout (channel 1) is closed (e.g. by suppress_unwanted_apt_pkg_messages),
+       channel 1 could be reused for the pipes of a worker pool. We must not let
+       libapt write it's messages into these pipes, so we let channel 1 point
+       to /dev/null in this case.
+    '''
+    try:
+        os.fstat(1)
+    except OSError:
+        fd = os.open(os.devnull, os.O_WRONLY)
+        if fd != 1:
+            os.dup2(fd, 1)
+            os.close(fd)
+
+
+def updateSuites(suites, jobs=4, maxPerHost=2, progress=None):
+    '''
+       Updates the locally cached repository metadata of each RepoSuite in suites
+       (see RepoSuite.update()) without querying them. This allows to separate the
+       (network bound) update phase from the query phase, so that following queries
+       can be executed without update.
+
+       jobs: maximum number of suites that are updated concurrently in separate
+             worker processes.
+
+       maxPerHost: maximum number of suites of the same repository host that are
+                   updated concurrently (in order to not overload a single server).
+
+       progress: optional callable progress(suite, summary) that is called for each suite
+                 as soon as it's update is finished.
+
+       Returns a list of summary dicts (in the order of suites) with the keys
+       "Suite", "Ok", "Errors" and "Seconds" describing the update result of each suite.
+    '''
+    suites = list(suites)
+    summaries = dict()
+
+    def finished(suite, summary):
+        summaries[suite] = summary
+        if progress:
+            progress(suite, summary)
+
+    if jobs <= 1 or len(suites) <= 1:
+        for suite in suites:
+            finished(suite, __updateSuite(suite))
+        return [summaries[suite] for suite in suites]
+
+    import multiprocessing
+    import queue
+    __protectStdoutChannel()
+    pending = list(suites)
+    running = dict() # map of host --> number of currently running updates
+    done = queue.Queue()
+    with multiprocessing.get_context("fork").Pool(min(jobs, len(suites))) as pool:
+        active = 0
+        while pending or active:
+            for suite in list(pending):
+                if active >= jobs:
+                    break
+                host = suite.getRepoHost()
+                if maxPerHost > 0 and running.get(host, 0) >= maxPerHost:
+                    continue
+                pending.remove(suite)
+                running[host] = running.get(host, 0) + 1
+                active += 1
+                pool.apply_async(__updateSuite, (suite,),
+                                 callback=functools.partial(__putResult, done, suite),
+                                 error_callback=functools.partial(__putError, done, suite))
+            suite, summary = done.get()
+            running[suite.getRepoHost()] -= 1
+            active -= 1
+            finished(suite, summary)
+    return [summaries[suite] for suite in suites]
+
+
+def __updateSuite(suite):
+    start = time.time()
+    try:
+        errors = suite.update()
+    except SystemError as e:
+        errors = [ str(e) ]
+    return {
+        "Suite": suite.getSuiteName(),
+        "Ok": len(errors) == 0,
+        "Errors": errors,
+        "Seconds": round(time.time() - start, 3)
+    }
+
+
+def __putResult(done, suite, summary):
+    done.put((suite, summary))
+
+
+def __putError(done, suite, exception):
+    done.put((suite, { "Suite": suite.getSuiteName(), "Ok": False, "Errors": [ str(exception) ], "Seconds": None }))
+
+
+def queryPackages(suites, requestPackages, isRE, requestArchs, requestComponents, requestedFields,
+                  update=True, latestOnly=False, querySources=False, jobs=1, progress=None):
+    '''
+       This method scans each RepoSuite in suites (with or without update) and queries
+       it for binary packages (or source packages if querySources==True) as described in
+       RepoSuite.queryPackages(...) and RepoSuite.querySources(...). It returns the union
+       of all the suite's result sets.
+
+       jobs: number of worker processes used to process the suites in parallel.
+
+       progress: optional callable progress(suite) that is called for each suite
+                 as soon as it's results are available.
+    '''
+    query = functools.partial(__scanAndQuerySuite, requestPackages, isRE, requestArchs, requestComponents,
+                              requestedFields, update, latestOnly, querySources)
+    result = set()
+    for suite, partialResult in forEachSuite(query, suites, jobs):
+        result.update(partialResult)
+        if progress:
+            progress(suite)
+    return result
+
+
+def iterPackages(suites, requestPackages, isRE, requestArchs, requestComponents, requestedFields,
+                 update=True, latestOnly=False, querySources=False, jobs=1, progress=None):
+    '''
+       Like queryPackages(...), but instead of collecting the results of all suites in a set,
+       this method returns a generator that yields the QueryResults sorted and without duplicates.
+
+       The suites are scanned and queried when this method is called. The results of each suite
+       are sorted separately (in the worker processes if jobs > 1) and stored in a temporary file.
+       The returned generator merges these sorted runs (a k-way merge in the order of suites),
+       so only a small part of all results needs to be kept in memory at a time.
+    '''
+    import tempfile
+    # the directory is also removed if the returned generator is never used
+    tmpDir = tempfile.TemporaryDirectory(prefix="apt-repos-")
+    query = functools.partial(__scanQueryAndSortSuite, tmpDir.name, requestPackages, isRE, requestArchs,
+                              requestComponents, requestedFields, update, latestOnly, querySources)
+    runFiles = list()
+    for suite, runFile in forEachSuite(query, suites, jobs):
+        runFiles.append(runFile)
+        if progress:
+            progress(suite)
+    return __mergeSortedRuns(tmpDir, runFiles)
+
+
+def __scanQueryAndSortSuite(directory, requestPackages, isRE, requestArchs, requestComponents, requestedFields,
+                            update, latestOnly, querySources, suite):
+    import tempfile
+    import pickle
+    results = sorted(__scanAndQuerySuite(requestPackages, isRE, requestArchs, requestComponents, requestedFields,
+                                         update, latestOnly, querySources, suite),
+                     key=__getattr__('QueryResult').getSortKey)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".run", delete=False) as fh:
+        # pickled in chunks, so that reading the run needs only little memory
+        for x in range(0, len(results), 1000):
+            pickle.dump(results[x:x+1000], fh)
+        return fh.name
+
+
+def __readSortedRun(filename):
+    import pickle
+    with open(filename, "rb") as fh:
+        while True:
+            try:
+                chunk = pickle.load(fh)
+            except EOFError:
+                return
+            yield from chunk
+
+
+def __mergeSortedRuns(tmpDir, runFiles):
+    import heapq
+    getSortKey = __getattr__('QueryResult').getSortKey
+    with tmpDir:
+        # duplicates are equal in sort order, so we only need to remember the
+        # (already yielded) results of the current group of equal results
+        group = list()
+        for result in heapq.merge(*[__readSortedRun(runFile) for runFile in runFiles], key=getSortKey):
+            if result in group:
+                continue
+            if len(group) > 0 and getSortKey(group[-1]) == getSortKey(result):
+                group.append(result)
+            else:
+                group = [ result ]
+            yield result
+
+
+def __scanAndQuerySuite(requestPackages, isRE, requestArchs, requestComponents, requestedFields,
+                        update, latestOnly, querySources, suite):
+    try:
+        suite.scan(update)
+        if not querySources:
+            return suite.queryPackages(requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly=latestOnly)
+        else:
+            return suite.querySources(requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly=latestOnly)
+    except SystemError as e:
+        logger.warning("Could not retrieve {} for suite {}:\n{}".format("sources" if querySources else "packages", suite.getSuiteName(), e))
+        return set()
@@ -37,9 +37,13 @@ import re
 import tempfile
 import subprocess
 import functools
+import contextlib
+import json
+import shutil
+import itertools
 
 import apt_repos
-from apt_repos import PackageField, QueryResult
+from apt_repos import PackageField
 
 logger = logging.getLogger(__name__)
 
@@ -86,7 +90,7 @@ def main():
 def createArgparsers():
     fieldChars = ", ".join(["({})={}".format(f.getChar(), f.getHeader()) for f in PackageField])
     if sys.stdout.isatty():
-        ttyWidth = os.popen('stty size', 'r').read().split()[1]
+        ttyWidth = shutil.get_terminal_size().columns
     else:
         ttyWidth = 80
     diffToolDefault = "diff,--side-by-side,--suppress-common-lines,--width={}"
@@ -109,22 +113,25 @@ def createArgparsers():
     parse_suites = subparsers.add_parser('suites', help='list configured suites', description=suites.__doc__)
     parse_show = subparsers.add_parser('show', help='show details about packages similar to apt-cache show', description=show.__doc__)
     parse_dsc = subparsers.add_parser('dsc', help='list urls of dsc-files for particular source-packages.', description=dsc.__doc__)
+    parse_update = subparsers.add_parser('update', help='update the cached packages lists of the selected suites', description=update.__doc__)
 
     parse_ls.set_defaults(sub_function=ls, sub_parser=parse_ls)
     parse_src.set_defaults(sub_function=src, sub_parser=parse_src)
     parse_suites.set_defaults(sub_function=suites, sub_parser=parse_suites)
     parse_show.set_defaults(sub_function=show, sub_parser=parse_show)
     parse_dsc.set_defaults(sub_function=dsc, sub_parser=parse_dsc)
+    parse_update.set_defaults(sub_function=update, sub_parser=parse_update)
 
     # mapping of common arguments:
     ___x = ____x = _____x = _______x = 0 # undefined for this subcommand
     __SS = __SSSS = 1                    # argument exists in a special variant
     commonArguments = {
-        parse_ls:     [ '-d', '-s', '-a', '-c', '-r', '-O', '-nu', '-nh', '-col', '-f', '-di', '-dt', 'package', ___x, ___x ],
-        parse_src:    [ '-d', '-s', ___x, '-c', '-r', '-O', '-nu', '-nh', __SSSS, '-f', '-di', '-dt', 'source' , ___x, ___x ],
-        parse_suites: [ '-d', __SS, ___x, ___x, ___x, ___x, ____x, ____x, _____x, ___x, ____x, ____x,  _______x, '-v', ___x ],
-        parse_show:   [ '-d', '-s', '-a', '-c', '-r', ___x, '-nu', ____x, __SSSS, ___x, '-di', '-dt', 'package', ___x, ___x ],
-        parse_dsc:    [ '-d', __SS, ___x, '-c', ___x, ___x, '-nu', ____x, _____x, ___x, ____x, ____x, 'source' , ___x, '-1' ],
+        parse_ls:     [ '-d', '-s', '-a', '-c', '-r', '-O', '-nu', '-nh', '-col', '-f', '-di', '-dt', 'package', ___x, ___x, '-j', '-ma', '-ws' ],
+        parse_src:    [ '-d', '-s', ___x, '-c', '-r', '-O', '-nu', '-nh', __SSSS, '-f', '-di', '-dt', 'source' , ___x, ___x, '-j', '-ma', '-ws' ],
+        parse_suites: [ '-d', __SS, ___x, ___x, ___x, ___x, ____x, ____x, _____x, ___x, ____x, ____x,  _______x, '-v', ___x, ___x, ____x, ___x ],
+        parse_show:   [ '-d', '-s', '-a', '-c', '-r', ___x, '-nu', ____x, __SSSS, ___x, '-di', '-dt', 'package', ___x, ___x, '-j', '-ma', ___x ],
+        parse_dsc:    [ '-d', __SS, ___x, '-c', ___x, ___x, '-nu', ____x, _____x, ___x, ____x, ____x, 'source' , ___x, '-1', '-j', '-ma', ___x ],
+        parse_update: [ '-d', '-s', ___x, ___x, ___x, ___x, ____x, ____x, _____x, ___x, ____x, ____x,  _______x, ___x, ___x, __SS, ____x, ___x ],
     }
 
     # add common arguments (if argument is defined in the above map)
@@ -163,6 +170,10 @@ def createArgparsers():
                         Use 'grouped_list' to do nearly the same as 'list' but add a newline for each
                         new value in the first column (which means we group over identical values in the
                         first column).""")
+        addArg(pars, o, "-ws", "--width-sample", type=int, default=0, help="""
+                        Calculate the column widths of the 'table' format from the first WIDTH_SAMPLE results
+                        only, so that the table is printed while the results are read. Longer values of later
+                        results may break the alignment of the table. The default is 0 (use all results).""")
         addArg(pars, o, "-di", "--diff", type=str, required=False, help="""
                         Specify the character of a colunm over which we should compare two different results.
                         The character needs to be one of the characters described for the --columns switch.
@@ -183,6 +194,13 @@ def createArgparsers():
         addArg(pars, o, "-1", "--first", action="store_true", default=False, help="""
                         Query only for the first matching dsc file for a source package, then skip the others sources
                         for this package.""")
+        addArg(pars, o, "-j", "--jobs", type=int, default=1, help="""
+                        Number of worker processes used to scan and query multiple suites in parallel.
+                        The default is 1 (no parallelization).""")
+        addArg(pars, o, "-ma", "--max-age", type=maxAge, help="""
+                        Skip downloading of packages lists for suites whose lists were successfully updated
+                        less than MAX_AGE ago. MAX_AGE is a number of seconds or a number followed by one of
+                        the units s, m, h or d (e.g. 15m). This overrides the MaxAge setting of the suites.""")
 
     # special variant for subcommand suites
     parse_suites.add_argument("-s", "--suite", default=':', help="""
@@ -208,11 +226,29 @@ def createArgparsers():
                         This specific ordering is in particular interesting together with --first.
                         The default value is 'default:'.""")
 
+    # special variant for subcommand update
+    parse_update.add_argument("-j", "--jobs", type=int, default=4, help="""
+                        Maximum number of suites that are updated concurrently (in separate worker processes).
+                        The default is 4.""")
+    parse_update.add_argument("-mh", "--max-per-host", type=int, default=2, help="""
+                        Maximum number of suites of the same repository host that are updated concurrently.
+                        Use 0 for no limit. The default is 2.""")
+
     for pars, o in commonArguments.items():
         addArg(pars, o, 'package', nargs='+', help='Name of a binary PACKAGE or source-package name prefixed as src:SOURCENAME')
         addArg(pars, o, 'source', nargs='+', help='Name of a source package')
 
-    return (parser, parse_ls, parse_src, parse_show, parse_suites, parse_dsc)
+    return (parser, parse_ls, parse_src, parse_show, parse_suites, parse_dsc, parse_update)
+
+
+def maxAge(value):
+    '''
+       argparse type for --max-age that converts a duration like 15m into seconds
+    '''
+    try:
+        return apt_repos.RepoSuite.parseMaxAge(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def addArg(parser, options, *args, **kwargs):
@@ -250,7 +286,7 @@ def show(args):
     '''
        subcommand show: print details about packages similar to what apt-cache show does
     '''
-    (result, requestFields) = queryPackages(args.suite, args.package, args.regex, args.architecture, args.component, args.columns, args.no_update)
+    (result, requestFields) = queryPackages(args.suite, args.package, args.regex, args.architecture, args.component, args.columns, args.no_update, jobs=args.jobs, maxAge=args.max_age)
 
     formatter = singleLines_formatter
 
@@ -264,7 +300,7 @@ def ls(args, querySources = False):
     '''
        subcommand list: search and print a list of binary packages
     '''
-    (result, requestFields) = queryPackages(args.suite, args.package, args.regex, args.architecture, args.component, args.columns, noUpdate=args.no_update, latestOnly=args.no_old_versions)
+    (result, requestFields) = queryPackages(args.suite, args.package, args.regex, args.architecture, args.component, args.columns, noUpdate=args.no_update, latestOnly=args.no_old_versions, jobs=args.jobs, maxAge=args.max_age)
     formatListResult(args, result, requestFields)
 
 
@@ -272,7 +308,7 @@ def src(args):
     '''
        subcommand source: search and print a list of source packages
     '''
-    (result, requestFields) = queryPackages(args.suite, args.source, args.regex, None, args.component, args.columns, noUpdate=args.no_update, querySources=True, latestOnly=args.no_old_versions)
+    (result, requestFields) = queryPackages(args.suite, args.source, args.regex, None, args.component, args.columns, noUpdate=args.no_update, querySources=True, latestOnly=args.no_old_versions, jobs=args.jobs, maxAge=args.max_age)
     formatListResult(args, result, requestFields)
 
 
@@ -284,6 +320,7 @@ def dsc(args):
     suites = list()
     for selector in args.suite.split(','):
         suites.extend(sorted(apt_repos.getSuites([selector]), reverse=True))
+    setMaxAge(suites, args.max_age)
     
     requestPackages = { p for p in args.source }
     requestComponents = { c for c in args.component.split(',') } if args.component else {}
@@ -296,11 +333,23 @@ def dsc(args):
     for package in requestPackages: # pre-seed results
         results[package] = list()
 
-    for x, suite in enumerate(suites):
-        pp(showProgress, ".{}".format(x+1))
-        queryDscFiles(results, suite, requestComponents, logger, not args.no_update, args.first)
-        if args.first and gotAllFirsts(results):
-           break
+    if args.jobs > 1:
+        # scan the suites in parallel but merge their results in the scan-order. As soon
+        # as the first suites satisfied all requests, the scans of later suites are cancelled.
+        query = functools.partial(queryDscFilesOfSuite, requestPackages, requestComponents, not args.no_update, args.first)
+        with contextlib.closing(apt_repos.forEachSuite(query, suites, args.jobs)) as suiteScans:
+            for x, (suite, suiteResults) in enumerate(suiteScans):
+                pp(showProgress, ".{}".format(x+1))
+                for package, urls in suiteResults.items():
+                    results[package].extend(urls)
+                if args.first and gotAllFirsts(results):
+                    break
+    else:
+        for x, suite in enumerate(suites):
+            pp(showProgress, ".{}".format(x+1))
+            queryDscFiles(results, suite, requestComponents, logger, not args.no_update, args.first)
+            if args.first and gotAllFirsts(results):
+               break
 
     pp(showProgress, '\n')
 
@@ -309,6 +358,20 @@ def dsc(args):
             print(url)
 
 
+def update(args):
+    '''
+       subcommand update: update the cached packages lists of the selected suites without
+       querying them. Multiple suites are updated concurrently. A summary of the update
+       results is printed in json format. Subsequent queries could then use --no-update.
+    '''
+    suites = sorted(apt_repos.getSuites(args.suite.split(',')))
+    summary = apt_repos.updateSuites(suites, jobs=args.jobs, maxPerHost=args.max_per_host)
+    print(json.dumps(summary, indent=2))
+    failed = [s['Suite'] for s in summary if not s['Ok']]
+    if len(failed) > 0:
+        raise AnError("Could not update {} of {} suites: {}".format(len(failed), len(summary), ", ".join(failed)))
+
+
 def queryDscFiles(results, suite, requestComponents, logger, update, first):
     '''
        queries for DSC-Files in sources lists provided by the apt_repos.Suite suite,
@@ -319,48 +382,44 @@ def queryDscFiles(results, suite, requestComponents, logger, update, first):
        - adds all found dsc-files to results
        - results is a hash map with key ("package name") to a "list of urls" mapping
     '''
-    import apt_pkg
     logger.debug("querying sources from " + suite.getSuiteName())
     suite.scan(update)
-    sourcesFiles = suite.getSourcesFiles()
-    if not sourcesFiles:
-        logger.debug("no sources files for suite {}".format(suite.getSuiteName()))
+    # results is pre-seeded with the requested packages. Skip the suite if it
+    # can't contribute to the (still missing) results
+    names = [name for name, urls in results.items() if not (first and len(urls) > 0)]
+    names = suite.filterSourceNames(names, requestComponents)
+    if len(names) == 0:
+        logger.debug("no matching sources in suite {}".format(suite.getSuiteName()))
         return
-    for sourcesFile in sourcesFiles: # there's one sourcesFile per component
+    index = suite.getSourcesIndex()
+    repoUrl = suite.getRepoUrl()
+    for (name, sourcesFile, component, unused_offset, unused_version, directory, dscFile) in index.getEntries(names):
         # skip unrequested components:
-        # TODO: this is too much implementation specific to the apt_pkg lib... improve if possible
-        m = re.search("^.*_([^_]+)_source_Sources$", sourcesFile)
-        if not m:
+        if not component:
             raise AnError("Sorry, I can't extract a component name from the sources file name {}".format(sourcesFile))
-        component = m.group(1)
         if len(requestComponents) > 0 and not component in requestComponents:
-            logger.debug("skipping component {} as not requested in --component".format(component))
             continue
-
-        logger.debug("parsing sources file {}".format(sourcesFile))
-        with open(sourcesFile, 'r') as f:
-            tagfile = apt_pkg.TagFile(f)
-            for package in tagfile:
-                name = package['Package']
-                urls = results.get(name) # results is pre-seeded with the requested packages
-                if urls == None:
-                    continue
-                dscFile = None
-                for f in package['Files'].split("\n"):
-                    (unused_md5, unused_size, fname) = f.strip().split(" ")
-                    if fname.endswith(".dsc"):
-                        dscFile = fname
-                if not dscFile:
-                    logger.warn("Did't find a dsc-file in Files-Attribute:\n{}".format(package['Files']))
-                    continue
-                path = os.path.join(package['Directory'], dscFile)
-                url = os.path.join(suite.getRepoUrl(), path)
-                urls.append(url)
-                if first and gotAllFirsts(results):
-                    return
+        if not dscFile:
+            logger.warn("Did't find a dsc-file for source package {} in {}".format(name, sourcesFile))
+            continue
+        path = os.path.join(directory, dscFile)
+        url = os.path.join(repoUrl, path)
+        results[name].append(url)
+        if first and gotAllFirsts(results):
+            return
     return
 
 
+def queryDscFilesOfSuite(requestPackages, requestComponents, update, first, suite):
+    '''
+       queries for DSC-Files of the requestPackages in a single suite (see queryDscFiles)
+       and returns a (new) hash map with key ("package name") to a "list of urls" mapping.
+    '''
+    results = { package : list() for package in requestPackages }
+    queryDscFiles(results, suite, requestComponents, logger, update, first)
+    return results
+
+
 def gotAllFirsts(results):
     if not results:
         return True
@@ -380,36 +439,41 @@ def formatListResult(args, result, requestFields):
 
     if args.diff:
         diff_formatter(result, requestFields, args.diff, args.diff_tool, args.no_header, list_formatter)
+    elif formatter == table_formatter:
+        formatter(result, requestFields, args.no_header, sys.stdout, args.width_sample)
     else:
         formatter(result, requestFields, args.no_header, sys.stdout)
 
 
-def table_formatter(result, requestFields, no_header, outfile):
+# Note: the formatters expect the results already sorted (see queryPackages(...)) and
+#       print them while iterating over the results.
+
+def table_formatter(result, requestFields, no_header, outfile, widthSample=0):
     header = [f.getHeader() for f in requestFields]    
-    resultList = sorted(result)
+    result = iter(result)
+    sample = list(itertools.islice(result, widthSample) if widthSample > 0 else result)
 
-    # calculate max col_widths (witch must be at least 1)
-    col_width = [max(len(str(x)) for x in col) for col in zip(*result)]
+    # calculate max col_widths (witch must be at least 1) from the sample
+    col_width = [max(len(str(x)) for x in col) for col in zip(*sample)]
     col_width = [max(1, w) for w in (col_width + [1]*(len(header)-len(col_width)))]
     if not no_header:
         # recalculate col_width for header, too
         col_width = [max(len(h), w) for h, w in zip(header, col_width)]
         print (" | ".join("{!s:{}}".format(h, w) for h, w in zip(header, col_width)), file=outfile)
         print (" | ".join("{!s:{}}".format("="*w, w) for w in col_width), file=outfile)
-    for r in resultList:
+    for r in itertools.chain(sample, result):
         print (" | ".join("{!s:{}}".format(d, w) for d, w in zip(r.getData(), col_width)), file=outfile)
 
 
 def list_formatter(result, requestFields, no_header, outfile, separateGroups=False):
     header = [f.getHeader() for f in requestFields]    
-    resultList = sorted(result)
 
     k = None
     if not no_header:
         print (" ".join(header), file=outfile)
         k = "__header__"
 
-    for r in resultList:
+    for r in result:
         # separate Blocks with newlines
         nk = r.getData()[0] if len(r.getData()) > 0 else None
         if separateGroups and k and k != nk:
@@ -425,10 +489,9 @@ def grouped_list_formatter(result, requestFields, no_header, outfile):
 
 def singleLines_formatter(result, requestFields, no_header, outfile):
     header = [f.getHeader() for f in requestFields]    
-    resultList = sorted(result)
 
     print(file=outfile)    
-    for r in resultList:
+    for r in result:
         data = r.getData()
         for h, d in zip(header, data):
             if h == "Full-Record":
@@ -467,7 +530,7 @@ def diff_formatter(result, requestFields, diffField, diffTool, no_header, subFor
                 newResultSet = aSet                
             else:
                 newData.append(d)
-        newResultSet.add(QueryResult(newFields, tuple(newData)))        
+        newResultSet.add(apt_repos.QueryResult(newFields, tuple(newData)))        
                 
     if len(newResults) != 2:
         raise AnError("We got not exactly 2 differentiators for Diff-Field '{}'. We found: '{}'. Use -di {}^... to ignore results for one of these values."
@@ -483,7 +546,7 @@ def diff_formatter(result, requestFields, diffField, diffTool, no_header, subFor
             if not no_header:
                 print("Results for {} '{}'".format(df.getHeader(), part), file=tmp)
                 print("", file=tmp)
-            subFormatter(newResults[part], newFields, no_header, tmp)
+            subFormatter(sorted(newResults[part], key=apt_repos.QueryResult.getSortKey), newFields, no_header, tmp)
 
     cmd = diffTool.split(",")
     cmd.extend(tmpFiles)
@@ -492,35 +555,51 @@ def diff_formatter(result, requestFields, diffField, diffTool, no_header, subFor
         os.remove(tmp)
 
 
-def queryPackages(suiteStr, requestPackages, regexStr, archStr, componentStr, fieldStr, noUpdate=False, querySources=False, latestOnly=False):
+def queryPackages(suiteStr, requestPackages, regexStr, archStr, componentStr, fieldStr, noUpdate=False, querySources=False, latestOnly=False, jobs=1, maxAge=None):
     '''
        queries Packages by the args provided on the command line and returns a
-       tuple of (queryResults, requestFields)
+       tuple of (queryResults, requestFields) where queryResults is a generator of the
+       sorted QueryResults (see apt_repos.iterPackages(...))
     '''
     suites = apt_repos.getSuites(suiteStr.split(','))
+    setMaxAge(suites, maxAge)
     requestArchs = { a for a in archStr.split(',') } if archStr else {}
     requestComponents = { c for c in componentStr.split(',') } if componentStr else {}
     requestFields = PackageField.getByFieldsString(fieldStr)
 
-    result = set()
     showProgress = True
     pp(showProgress, "{}querying packages lists for {} suites".format(
         "updating (use --no-update to skip) and " if not noUpdate else "", len(suites)))
-    for x, suite in enumerate(suites):
-        pp(showProgress, '.')
-        try:
-            suite.scan(not noUpdate)
-            pp(showProgress, x+1)
-            if not querySources:
-                result = result.union(suite.queryPackages(requestPackages, regexStr, requestArchs, requestComponents, requestFields, latestOnly=latestOnly))
-            else:
-                result = result.union(suite.querySources(requestPackages, regexStr, requestArchs, requestComponents, requestFields, latestOnly=latestOnly))
-        except SystemError as e:
-            logger.warn("Could not retrieve {} for suite {}:\n{}".format("sources" if querySources else "packages", suite.getSuiteName(), e))
+    progress = Progress(showProgress)
+    result = apt_repos.iterPackages(suites, requestPackages, regexStr, requestArchs, requestComponents, requestFields,
+                                    update=not noUpdate, latestOnly=latestOnly, querySources=querySources,
+                                    jobs=jobs, progress=progress)
     pp(showProgress, '\n')
     return (result, requestFields)
 
 
+def setMaxAge(suites, maxAge):
+    '''
+       overrides the MaxAge of all suites if maxAge (--max-age) is set
+    '''
+    if maxAge != None:
+        for suite in suites:
+            suite.setMaxAge(maxAge)
+
+
+class Progress:
+    '''
+       Callable that prints the progress counter for each processed suite
+    '''
+    def __init__(self, show):
+        self.show = show
+        self.count = 0
+
+    def __call__(self, unused_suite):
+        self.count += 1
+        pp(self.show, ".{}".format(self.count))
+
+
 def pp(show, message):
     '''
        prints and flushes a progress message <message> without newline to stderr if <show> is True.
@@ -535,10 +614,9 @@ class AnError (Exception):
 
 
 if __name__ == "__main__":
-    with apt_repos.suppress_unwanted_apt_pkg_messages() as forked:
-        if forked:
-            try:
-                main()
-            except (AnError) as e:
-                print("\n" + str(e) + "\n",  file=sys.stderr)
-                sys.exit(1)
+    # unwanted messages of apt_pkg are suppressed by RepoSuite (see apt_repos.silenced_stdout_channel())
+    try:
+        main()
+    except (AnError) as e:
+        print("\n" + str(e) + "\n",  file=sys.stderr)
+        sys.exit(1)
@@ -24,11 +24,25 @@ import os
 import sys
 import argparse
 import logging
+import tempfile
+import pickle
+import json
+import time
+import contextlib
+import apt_pkg
 
 sys.path.insert(0, "../")
 import apt_repos
 from apt_repos import PackageField, QueryResult
 from apt_repos.Repository import Repository
+from apt_repos.RepoSuite import RepoSuite
+from apt_repos import RepositoryScanner
+from apt_repos.PackagesIndex import PackagesIndex
+from apt_repos.SourcesIndex import SourcesIndex
+from apt_repos.MappedTagFile import MappedTagFile
+from apt_repos.CompiledConfig import CompiledConfig
+from apt_repos.QueryPlan import QueryPlan
+from apt_repos.PatternMatcher import PatternMatcher
 
 
 def testPrintHelloWorld():
@@ -123,6 +137,37 @@ def testQueryResult():
         compareAndPrintQueryResults(x, y)
 
 
+def testCompactQueryResult():
+    a1 = PVRMock({ "name" : "a-pkg", "ver_str" : "1.2", "arch" : "".join(["i3", "86"]), "section" : "".join(["ma", "in"]) })
+    a2 = PVRMock({ "name" : "a-pkg", "ver_str" : "1.3", "arch" : "".join(["i3", "86"]), "section" : "".join(["ma", "in"]) })
+    plan = QueryPlan.forBinaryPackages('pvaS', None)
+    x = QueryResult(plan.fields, plan.extract(a1, a1, None, "a"))
+    y = QueryResult(plan.fields, plan.extract(a2, a2, None, "a"))
+    print("has __dict__: {}".format(hasattr(x, '__dict__')))
+    print("shared fields: {}".format(x.fields is y.fields))
+    print("shared architecture and section: {}".format(x.data[2] is y.data[2] and x.data[3] is y.data[3]))
+    (x2, y2) = pickle.loads(pickle.dumps([x, y]))
+    print("unpickled: {} {}, equal: {}, x<y: {}".format(x2, y2, x2 == x and y2 == y, x2 < y2))
+
+
+def testQueryPlan():
+    suite = PVRMock({ "getRepoUrl" : lambda: "http://repo.example.org/debian" })
+    pkg = PVRMock({ "name" : "a-pkg", "ver_str" : "1.2", "arch" : "i386", "section" : "contrib/utils", "priority" : 4, "size" : 10,
+                    "filename" : "pool/contrib/a/a/a-pkg_1.2_i386.deb", "long_desc" : "A package", "record" : "Package: a-pkg" })
+    source = { "Package" : "a", "Version" : "1.2", "Section" : "contrib/utils", "Priority" : "optional", "Architecture" : "i386 amd64",
+               "Directory" : "pool/contrib/a/a", "Files" : "0123 10 a_1.2.tar.gz\n 4567 11 a_1.2.dsc" }
+    for fieldsStr in [ 'pva', 'pvaSPzC', 'y', 'L', 'R', 'B', 'F', 'pvaSCyLRBF' ]:
+        plan = QueryPlan.forBinaryPackages(fieldsStr, suite)
+        print("binary '{}': needsRecord={} data={}".format(fieldsStr, plan.needsRecord,
+              plan.extract(pkg, pkg, pkg if plan.needsRecord else None, "a")))
+    for fieldsStr in [ 'CvaSP', 'yBF', 'p' ]:
+        plan = QueryPlan.forSourcePackages(fieldsStr, suite)
+        try:
+            print("source '{}': data={}".format(fieldsStr, plan.extract(source)))
+        except Exception as e:
+            print("source '{}': {}".format(fieldsStr, e))
+
+
 def compareAndPrintQueryResults(x, y):
     print()
     print("x = " + str(x))
@@ -133,6 +178,302 @@ def compareAndPrintQueryResults(x, y):
     print("sameHash = " + str(x.__hash__() == y.__hash__()))
 
 
+def testVersionKey():
+    apt_repos._initAptPkg()
+    versions = [ "1.0", "1.0~", "1.0~rc1", "1.0a", "1.0.0", "1.00", "1.01", "1.1", "1", "1~", "1+b1", "1-0", "1-1", "1-",
+                 "0:1", "1:0.9", "01:1.0-1", "2:1.0-1", "1.2~6deb2", "1.2~55deb2", "1.2-1ubuntu1", "1.2-1.1", "a", "a0",
+                 "~", "~~", "", ":1", "-1", "1:", "1.0-1~bpo8+1", "1.0-1+deb8u1", "1:1.9.1-1", "10.0", "9.99" ]
+    for x in versions:
+        for y in versions:
+            cmp = apt_pkg.version_compare(x, y)
+            (kx, ky) = (QueryResult.getVersionKey(x), QueryResult.getVersionKey(y))
+            if (cmp < 0) != (kx < ky) or (cmp == 0) != (kx == ky):
+                print("different order for '{}' and '{}'".format(x, y))
+    print("sorted by version key: {}".format(sorted(versions, key=QueryResult.getVersionKey)))
+    fields = PackageField.getByFieldsString('pvs')
+    results = [ QueryResult(fields, ("a", v, "mySuite")) for v in [ "1.0", "1.0~rc1", "1:0.9", "1.0-1" ] ]
+    print("sorted results: {}".format([r.getData()[1] for r in sorted(results, key=QueryResult.getSortKey)]))
+
+
+def testPatternMatcher():
+    for pattern in [ "^lib", "^python3-", "^src:foo", "^pkg1[0-5]$", "^a+b", "^ab*c", "^a\\.b", "^a\\db", "^(lib)", "lib", "^lib|^foo", "^" ]:
+        print("literal prefix of '{}': {}".format(pattern, PatternMatcher.getLiteralPrefix(pattern)))
+    names = [ "foo", "lib", "libfoo", "libfoo-dev", "python3", "python3-foo", "python3-lib", "src:lib", "xlib" ]
+    for patterns in [ [ "^lib" ], [ "^lib", "^python3-", "foo$" ], [ "^(a)\\1", "lib" ], [ "^lib", "^libfoo" ], [ "^src:", "^s" ] ]:
+        matcher = PatternMatcher(patterns)
+        print("patterns {} (combined={}, prefixes={}):".format(patterns, matcher.combined != None, matcher.getPrefixes()))
+        print("  matches: {}".format([(name, matcher.search(name)) for name in names if matcher.matches(name)]))
+        if matcher.getPrefixes() != None:
+            print("  selected by prefixes: {}".format(list(PatternMatcher.selectByPrefixes(sorted(names), matcher.getPrefixes()))))
+
+
+def testPackagesIndex():
+    a1 = PVRMock({ "name" : "a-pkg", "architecture" : "i386", "ver_str" : "1.0", "source" : "a" })
+    a2 = PVRMock({ "name" : "a-pkg", "architecture" : "amd64", "ver_str" : "1.0", "source" : "a" })
+    b1 = PVRMock({ "name" : "b-pkg", "architecture" : "amd64", "ver_str" : "2.0", "source" : "b" })
+    b2 = PVRMock({ "name" : "b-doc", "architecture" : "amd64", "ver_str" : "2.0", "source" : "b" })
+    b3 = PVRMock({ "name" : "b-doc", "architecture" : "amd64", "ver_str" : "1.0", "source" : "b-old" })
+    a1.version_list = [a1]
+    a2.version_list = [a2]
+    b1.version_list = [b1]
+    b2.version_list = [b2, b3]
+    cache = PVRMock({ "packages" : [a1, a2, b1, b2] })
+    lookupSource = lambda pkg, version: version.source
+
+    index = PackagesIndex.build(cache, lookupSource, ["fingerprint"])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        indexFile = os.path.join(tmpdir, "packages.index")
+        index.save(indexFile)
+        print("load with other fingerprint: " + str(PackagesIndex.load(indexFile, ["other"])))
+        index = PackagesIndex.load(indexFile, ["fingerprint"])
+    for name in ["a-pkg", "b-pkg", "b-doc", "nonexistent"]:
+        print("{}: {}".format(name, index.getPackageKeys(name)))
+    for source in sorted(index.getSourceNames()) + ["nonexistent"]:
+        print("src:{}: {}".format(source, index.getVersionKeysBySource(source)))
+    for name, arch, version in [("b-doc", "amd64", "2.0"), ("b-doc", "amd64", "1.0"), ("b-doc", "i386", "1.0")]:
+        print("source of {} {} {}: {}".format(name, arch, version, index.getSource(name, arch, version)))
+
+
+def testSourcesIndex():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sourcesFile = os.path.join(tmpdir, "repo_dists_suite_main_source_Sources")
+        with open(sourcesFile, "w") as f:
+            for (name, version) in [("b", "2.0"), ("a", "1.0"), ("b", "1.0"), ("ab", "0.1")]:
+                f.write("Package: {0}\nVersion: {1}\nDirectory: pool/main/{0}\n".format(name, version))
+                f.write("Files:\n 0123 10 {0}_{1}.tar.gz\n 4567 20 {0}_{1}.dsc\n\n".format(name, version))
+        index = SourcesIndex.build([sourcesFile], ["fingerprint"])
+        indexFile = os.path.join(tmpdir, "sources.index")
+        index.save(indexFile)
+        print("load with other fingerprint: " + str(SourcesIndex.load(indexFile, ["other"])))
+        index = SourcesIndex.load(indexFile, ["fingerprint"])
+        print("sorted names: {}".format(index.getSortedNames()))
+        for names in [["b"], ["ab", "a"], ["nonexistent"]]:
+            print("{}:".format(names))
+            for (name, sFile, component, offset, version, directory, dscFile) in index.getEntries(names):
+                print("  {} {} {} {} {}".format(name, component, version, directory, dscFile))
+                with apt_pkg.TagFile(sourcesFile) as tagfile:
+                    tagfile.jump(offset)
+                    print("  section at offset: {} {}".format(tagfile.section['Package'], tagfile.section['Version']))
+        namesFile = os.path.join(tmpdir, "sources.names")
+        index.saveNames(namesFile)
+        print("names with other fingerprint: " + str(SourcesIndex.loadNames(namesFile, ["other"])))
+        print("names by component: {}".format(SourcesIndex.loadNames(namesFile, ["fingerprint"])))
+
+
+def testMappedTagFile():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sourcesFile = os.path.join(tmpdir, "Sources")
+        with open(sourcesFile, "w") as f:
+            f.write("Package: a\nVersion: 1.0\nFiles:\n 0123 10 a_1.0.dsc\n 4567 20 a_1.0.tar.gz\n\n")
+            f.write("Package: b\nversion: 2.0\n")
+        offsets = list()
+        with apt_pkg.TagFile(sourcesFile) as tagfile:
+            while True:
+                offset = tagfile.offset()
+                if not tagfile.step():
+                    break
+                offsets.append(offset)
+        mapped = MappedTagFile(sourcesFile)
+        for offset in offsets:
+            view = mapped.getSection(offset)
+            print("offset {}: keys={} text={}".format(offset, view.keys(), repr(str(view))))
+            print("  Package={} Version={} Files={} Directory={} has Files: {}".format(
+                view['Package'], view['Version'], repr(view.get('Files')), view.get('Directory', 'n/a'), 'Files' in view))
+            print("  pickled: {}".format(repr(pickle.loads(pickle.dumps(view)))))
+
+
+def testCompiledConfig():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "a.suites"), "w") as f:
+            json.dump([ { "Suite": "ubuntu:xenial", "Oid": "xenial", "Tags": [ "lts" ] },
+                        { "Suite": "ubuntu:bionic", "Tags": [ "lts" ] },
+                        { "Suite": "debian:stretch" },
+                        { "Description": "entry without suite" } ], f)
+        with open(os.path.join(tmpdir, "b.suites"), "w") as f:
+            json.dump([ { "Oid": "xenial", "Description": "overridden" } ], f)
+        with open(os.path.join(tmpdir, "c.repos"), "w") as f:
+            json.dump([ { "Prefix": "mirror", "Url": "http://127.0.0.1:1/", "Suites": [ "x", { "Suite": "y", "Tags": [ "yy" ] } ] } ], f)
+        signature = CompiledConfig.getSignature([tmpdir])
+        config = CompiledConfig.build([tmpdir], signature)
+        print("suites: {}".format([desc for (desc, unused_basedir, filename) in config.suites]))
+        print("warnings: {}".format(config.warnings))
+        for (selRepo, selSuite) in [ ("", ""), ("ubuntu", ""), ("lts", "bionic"), ("", "stretch"), ("debian", "xenial") ]:
+            print("suites for '{}:{}': {}".format(selRepo, selSuite, config.selectSuites(selRepo, selSuite)))
+        for selRepo in [ "", "mirror", "yy", "ubuntu" ]:
+            print("repos for '{}:': {}".format(selRepo, config.selectRepos(selRepo)))
+        cacheFile = os.path.join(tmpdir, "cache", "config.cache")
+        config.save(cacheFile)
+        print("loaded with same signature: {}".format(CompiledConfig.load(cacheFile, signature).suites == config.suites))
+        with open(os.path.join(tmpdir, "b.suites"), "w") as f:
+            f.write("[]")
+        print("loaded after change: {}".format(CompiledConfig.load(cacheFile, CompiledConfig.getSignature([tmpdir]))))
+
+
+def testLazyRootdir():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "test.gpg"), "wb") as f:
+            f.write(b"keyring")
+        desc = { "Suite": "test:lazy", "SourcesList": "deb file:///nonexistent/ lazy main",
+                 "Architectures": [ "amd64" ], "TrustedGPG": "test.gpg" }
+        suites = [ RepoSuite(tmpdir, os.path.join(tmpdir, "cache"), desc, x) for x in range(2) ]
+        print("cache created by constructor: {}".format(os.path.exists(os.path.join(tmpdir, "cache"))))
+        print("keyring shared: {}".format(suites[0].getTrustedGPG() is suites[1].getTrustedGPG()))
+        suites[0]._prepareRootdir()
+        for file in [ "/etc/apt/sources.list", "/etc/apt/apt.conf", "/etc/apt/trusted.gpg", "/var/lib/dpkg/status" ]:
+            with open(suites[0].rootdir + file, "rb") as f:
+                print("{}: {}".format(file, f.read()))
+
+
+def testParseReleaseFile():
+    header = "Origin: test\nSuite: stable\nCodename: bookworm\nArchitectures: amd64 i386\nComponents: main contrib\n"
+    binaries = " 0123 100 main/binary-amd64/Packages\n 4567 200 main/binary-amd64/Packages.xz\n"
+    sources = " 89ab 300 main/source/Sources.xz\n"
+    release = header + "MD5Sum:\n" + binaries + sources + "SHA256:\n" + binaries + sources
+    inRelease = "-----BEGIN PGP SIGNED MESSAGE-----\nHash: SHA256\n\n" + release + \
+                "-----BEGIN PGP SIGNATURE-----\n\niQIzBAEBCAAdFiEE\n-----END PGP SIGNATURE-----\n"
+    for name, data in [("Release", release),
+                       ("InRelease", inRelease),
+                       ("without Sources", header + "SHA256:\n" + binaries),
+                       ("without suite", "Origin: test\n"),
+                       ("html", "<html><body>Not Found</body></html>")]:
+        print("{}: {}".format(name, RepositoryScanner.parseReleaseFile("file:///dists/stable/Release", data.encode('utf-8'))))
+
+
+def testScanReleases():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for folder, suite in [("zeta", "z1"), ("alpha", "a1"), ("alpha/updates", "a2"), ("alpha/main/x", "ignored"),
+                              ("beta/sub/deep", "b3"), ("beta/sub2", "b2"), ("gamma/by-hash/q", "ignored")]:
+            os.makedirs(os.path.join(tmpdir, "dists", folder))
+            with open(os.path.join(tmpdir, "dists", folder, "Release"), "w") as f:
+                f.write("Suite: {}\nComponents: main\nArchitectures: amd64\n".format(suite))
+        url = "file://" + tmpdir
+        for maxDepth in [None, 0, 1, 2]:
+            suites = RepositoryScanner.scanRepository(url, maxDepth=maxDepth)
+            print("maxDepth={}: {}".format(maxDepth, [s['suite'] for s in suites]))
+        suites = RepositoryScanner.scanRepository(url, suites=["zeta", "alpha/updates", "alpha"], jobs=2)
+        print("selected suites: {}".format([s['suite'] for s in suites]))
+
+
+def testHttpPool():
+    pool = RepositoryScanner.getHttpPool()
+    print("shared pool: {}".format(pool is RepositoryScanner.getHttpPool()))
+    RepositoryScanner.setHttpOptions(timeout=5, retries=1, maxPerHost=2)
+    newPool = RepositoryScanner.getHttpPool()
+    print("new pool after changed options: {}".format(newPool is not pool))
+    for key in ['maxsize', 'block', 'timeout']:
+        print("{}: {}".format(key, newPool.connection_pool_kw[key]))
+
+
+def testScanCache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cacheFile = os.path.join(tmpdir, "scan.cache")
+        cache = RepositoryScanner.ScanCache(cacheFile)
+        print("empty cache: {}".format(cache.get("http://127.0.0.1:1/dists/")))
+        cache.put("http://127.0.0.1:1/dists/", '"etag"', None, { 'release': None, 'subfolders': {} })
+        cache.save()
+        entry = RepositoryScanner.ScanCache(cacheFile).get("http://127.0.0.1:1/dists/")
+        print("reloaded: ETag={} Last-Modified={} Result={}".format(entry['ETag'], entry['Last-Modified'], entry['Result']))
+
+        RepositoryScanner.setScanCacheFile(cacheFile)
+        parse = lambda data: "parsed"
+        print("fresh result: {}".format(RepositoryScanner.getCachedResult("http://127.0.0.1:1/dists/", parse, 3600)))
+        print("result for unreachable url: {}".format(RepositoryScanner.getCachedResult("http://127.0.0.1:1/dists/", parse)))
+        try:
+            RepositoryScanner.getCachedResult("http://127.0.0.1:1/uncached/", parse)
+        except Exception:
+            print("uncached unreachable url raises an exception")
+        RepositoryScanner.setScanCacheFile(None)
+
+
+def testSilencedStdoutChannel():
+    print("before", flush=True)
+    with apt_repos.silenced_stdout_channel():
+        os.write(1, b"written to channel 1 inside the block\n")
+    os.write(1, b"written to channel 1 after the block\n")
+    print("after")
+
+
+def testForEachSuite():
+    suites = ["suite{}".format(x) for x in range(5)]
+    for jobs in [1, 3]:
+        print("jobs={}".format(jobs))
+        for suite, result in apt_repos.forEachSuite(str.upper, suites, jobs):
+            print("{} --> {}".format(suite, result))
+    # closing the generator cancels the (slow) calls for the remaining suites
+    start = time.time()
+    with contextlib.closing(apt_repos.forEachSuite(slowUpperExceptFirst, suites, 3)) as results:
+        for suite, result in results:
+            print("{} --> {}".format(suite, result))
+            break
+    print("remaining calls cancelled: {}".format(time.time() - start < 10))
+
+
+def slowUpperExceptFirst(suite):
+    if suite != "suite0":
+        time.sleep(30)
+    return suite.upper()
+
+
+class SuiteMock:
+    def __init__(self, name, host):
+        self.name = name
+        self.host = host
+
+    def getSuiteName(self):
+        return self.name
+
+    def getRepoHost(self):
+        return self.host
+
+    def update(self):
+        return ["E:Host {} not available".format(self.host)] if self.host == "bad.example.org" else []
+
+
+class QuerySuiteMock:
+    def __init__(self, name, packages):
+        self.name = name
+        self.packages = packages
+
+    def scan(self, update):
+        pass
+
+    def queryPackages(self, requestPackages, isRE, requestArchs, requestComponents, requestedFields, latestOnly=False):
+        return { QueryResult(requestedFields, (name, version)) for (name, version) in self.packages }
+
+
+def testIterPackages():
+    fields = PackageField.getByFieldsString('pv')
+    suites = [ QuerySuiteMock("suite1", [ ("b", "1.0"), ("a", "1.10"), ("c", "1.0") ]),
+               QuerySuiteMock("suite2", [ ("b", "1.0"), ("a", "1.9"), ("a", "1.10~rc1") ]),
+               QuerySuiteMock("suite3", []) ]
+    for jobs in [1, 3]:
+        print("jobs={}".format(jobs))
+        for result in apt_repos.iterPackages(suites, ["."], True, None, None, fields, update=False, jobs=jobs):
+            print(result)
+
+
+def testUpdateSuites():
+    suites = [SuiteMock("suite{}".format(x), ["a.example.org", "b.example.org", "bad.example.org"][x % 3]) for x in range(7)]
+    for jobs in [1, 3]:
+        print("jobs={}".format(jobs))
+        for summary in apt_repos.updateSuites(suites, jobs=jobs, maxPerHost=1):
+            print("{} ok={} errors={}".format(summary['Suite'], summary['Ok'], summary['Errors']))
+
+
+def testMaxAge():
+    for value in [None, 30, "90", "90s", "15m", "2h", "1d", "1.5h", " 5 m ", "10x", "-1", True]:
+        try:
+            print("{!r} --> {!r}".format(value, RepoSuite.parseMaxAge(value)))
+        except ValueError as e:
+            print("{!r} --> ValueError: {}".format(value, e))
+    with tempfile.TemporaryDirectory() as cacheDir:
+        suiteDesc = { "Suite": "test:maxage", "SourcesList": "deb file:///nonexistent/ maxage main", "Architectures": [ "amd64" ], "MaxAge": "1h" }
+        suite = RepoSuite(".", cacheDir, suiteDesc, 1)
+        print("maxAge={} upToDate={}".format(suite.getMaxAge(), suite.isUpToDate()))
+        suite.setMaxAge(None)
+        print("maxAge={} upToDate={}".format(suite.getMaxAge(), suite.isUpToDate()))
+
+
 def testQueryPackages():
     apt_repos.setAptReposBaseDir(".")
     fields = PackageField.getByFieldsString('pvsaSCFB')
@@ -9,7 +9,7 @@ sys.path.append(".")
 
 from build_manpage import ManPageFormatter
 
-from apt_repos_cli import createArgparsers, __doc__, ls, show, suites, dsc, src
+from apt_repos_cli import createArgparsers, __doc__, ls, show, suites, dsc, src, update
 
 
 def main():	
@@ -20,7 +20,7 @@ def main():
                                 "https://github.com/chrlutz/apt-repos")
     }
 
-    (parser, parser_ls, parser_src, parser_show, parser_suites, parser_dsc) = createArgparsers()
+    (parser, parser_ls, parser_src, parser_show, parser_suites, parser_dsc, parser_update) = createArgparsers()
 
     createManpage(parser, 'apt-repos', __doc__.strip(), sections)
     createManpage(parser_ls, 'apt-repos ls', ls.__doc__.strip(), sections)
@@ -28,6 +28,7 @@ def main():
     createManpage(parser_dsc, 'apt-repos dsc', dsc.__doc__.strip(), sections)
     createManpage(parser_show, 'apt-repos show', show.__doc__.strip(), sections)
     createManpage(parser_suites, 'apt-repos suites', suites.__doc__.strip(), sections)
+    createManpage(parser_update, 'apt-repos update', update.__doc__.strip(), sections)
 
 
 def createManpage(parser, appname, desc, sections):